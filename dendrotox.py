@@ -32,24 +32,35 @@
 ################################################################################
 """
 
+import atexit
+import collections
+import concurrent.futures
 import datetime
+import errno
+import fcntl
+import hashlib
 import json
 import logging
 import os
-import requests
+import select
+import signal
+import stat
+import struct
 import sys
+import termios
+import threading
 import time
 import uuid
 import wave
 if sys.version_info[0] < 3:
+    import Queue as queue
     import subprocess32 as subprocess
+    from distutils.spawn import find_executable as which
 else:
+    import queue
     import subprocess
+    from shutil import which
 
-import megaparsex
-import propyte
-from pydub import AudioSegment
-import shijian
 import technicolor
 
 name    = "dendrotox"
@@ -59,11 +70,22 @@ log = logging.getLogger(name)
 log.addHandler(technicolor.ColorisingStreamHandler())
 log.setLevel(logging.INFO)
 
-global messages_received
-messages_received = []
-
 class Message(object):
 
+    __slots__ = [
+        "_raw_string",
+        "_datetime_object",
+        "_contact",
+        "_text",
+        "_seen",
+        "_UUID4",
+        "_store",
+        "_index",
+        "_time",
+        "_parse",
+        "_offset"
+    ]
+
     def __init__(
         self,
         raw_string                       = None,
@@ -71,29 +93,65 @@ class Message(object):
         contact                          = None,
         text                             = None,
         seen                             = False,
-        datetime_from_instantiation_time = True
+        datetime_from_instantiation_time = True,
+        offset                           = None  # byte offset in text_out
         ):
         """
         The raw string time resolution is minutes, which is often insufficient,
-        so, by default, the datetime is defined by the instantiation time.
+        so, by default, the datetime is defined by the instantiation time. The
+        text and datetime are parsed from the raw string, and the UUID is
+        generated, only when first accessed.
         """
         self._raw_string      = raw_string
         self._datetime_object = datetime_object
         self._contact         = contact
         self._text            = text
         self._seen            = seen
-        self._UUID4           = str(uuid.uuid4())
+        self._UUID4           = None
+        self._store           = None
+        self._index           = None
+        self._time            = time.time()
+        self._offset          = offset
+        # raw string parsing pending: None, "text" or "text and datetime"
+        self._parse           = None
         if raw_string:
-            raw_string_split = raw_string.split()
             if datetime_from_instantiation_time:
-                self.set_datetime_object(datetime_object = datetime.datetime.utcnow())
+                self._parse = "text"
             else:
-                self.set_datetime_object(datetime_string = " ".join(raw_string_split[:2]))
-            self.set_text(text = " ".join(raw_string_split[2:]))
+                self._parse = "text and datetime"
+
+    def _parse_raw_string(
+        self
+        ):
+        parse, self._parse = self._parse, None
+        raw_string_split = self._raw_string.split()
+        if parse == "text and datetime":
+            self.set_datetime_object(datetime_string = " ".join(raw_string_split[:2]))
+        self.set_text(text = " ".join(raw_string_split[2:]))
+
+    def time(
+        self
+        ):
+        """
+        Return the instantiation time in seconds since the epoch.
+        """
+        return self._time
+
+    def offset(
+        self
+        ):
+        """
+        Return the byte offset of the raw string in the contact's text_out.
+        """
+        return self._offset
 
     def datetime_object(
         self
         ):
+        if self._parse:
+            self._parse_raw_string()
+        if self._datetime_object is None and self._raw_string:
+            self._datetime_object = datetime.datetime.utcfromtimestamp(self._time)
         return self._datetime_object
 
     def set_datetime_object(
@@ -102,6 +160,8 @@ class Message(object):
         datetime_string = None,
         datetime_style  = "%Y-%m-%d %H:%M"
         ):
+        if self._parse:
+            self._parse_raw_string()
         if not datetime_object:
             datetime_object = datetime.datetime.strptime(
                 datetime_string,
@@ -113,7 +173,7 @@ class Message(object):
         self,
         datetime_style = "%Y-%m-%dT%H%M%SZ"
         ):
-        return self._datetime_object.strftime(datetime_style)
+        return self.datetime_object().strftime(datetime_style)
 
     def contact(
         self,
@@ -135,12 +195,16 @@ class Message(object):
         ):
         if not preserve_visibility:
             self.set_seen()
+        if self._parse:
+            self._parse_raw_string()
         return self._text
 
     def set_text(
         self,
         text = None
         ):
+        if self._parse:
+            self._parse_raw_string()
         self._text = text
 
     def UUID4(
@@ -149,6 +213,8 @@ class Message(object):
         ):
         if not preserve_visibility:
             self.set_seen()
+        if self._UUID4 is None:
+            self._UUID4 = str(uuid.uuid4())
         return self._UUID4
 
     def seen(
@@ -159,12 +225,18 @@ class Message(object):
     def set_seen(
         self
         ):
-        self._seen = True
+        if not self._seen:
+            self._seen = True
+            if self._store is not None:
+                self._store.mark_seen(self)
 
     def set_not_seen(
         self
         ):
-        self._seen = False
+        if self._seen:
+            self._seen = False
+            if self._store is not None:
+                self._store.mark_not_seen(self)
 
     def __str__(
         self,
@@ -196,117 +268,3174 @@ class Message(object):
             text            = self.text()
         )
 
-def self_ID():
-    try:
-        self_ID = [line.rstrip("\n") for line in open("id")][0]
-        return self_ID
-    except:
-        log.error("error -- ratox not running?")
+class TextOutTail(object):
 
-def start_messaging(
-    path_ratox_executable = "/usr/local/bin/ratox",
-    launch                = True,
-    pause                 = True,
-    pause_time            = 20,
-    log_level             = logging.INFO
-    ):
-    log.setLevel(log_level)
-    executables = [
-        "aplay",
-        "arecord",
-        "bash",
-        "ffmpeg",
-        "ratox",
-        "sox",
-        "text2wave"
-    ]
-    executables_speech = [
-        "festival",
-        #"espeak",
-        #"pico2wave",
-        #"deep_throat.py"
-    ]
-    for executable in executables:
-        if not shijian.which(executable):
-            log.error("error -- executable not found: {executable}".format(executable = executable))
-            sys.exit()
-    if not any([shijian.which(executable) for executable in executables_speech]):
-        log.error("error -- no speech programs found")
-        sys.exit()
-    if not running("ratox"):
-        if os.path.isfile(path_ratox_executable) and launch:
-            log.info("launch ratox")
-            engage_command(
-                command    = path_ratox_executable,
-                background = True
+    def __init__(
+        self,
+        filepath = None,
+        offset   = 0
+        ):
+        """
+        Read lines appended to a ratox `text_out` file incrementally by tracking
+        the byte offset reached by the previous read. A trailing line without a
+        newline is held back until it is completed. If the file shrinks
+        (truncation) or is replaced (rotation), reading restarts from its
+        beginning.
+        """
+        self._filepath = filepath
+        self._offset   = offset
+        self._partial  = b""
+        self._inode    = None
+
+    def filepath(
+        self
+        ):
+        return self._filepath
+
+    def offset(
+        self
+        ):
+        """
+        Return the byte offset of the end of the complete lines read.
+        """
+        return self._offset - len(self._partial)
+
+    def inode(
+        self
+        ):
+        return self._inode
+
+    def resume(
+        self,
+        inode  = None,
+        offset = None
+        ):
+        """
+        Continue reading from an offset reached previously if the file is the
+        same file and has not been truncated. Return a boolean indicating
+        whether reading is resumed.
+        """
+        try:
+            status = os.stat(self._filepath)
+        except OSError:
+            return False
+        if status.st_ino != inode or status.st_size < offset:
+            return False
+        self._inode   = inode
+        self._offset  = offset
+        self._partial = b""
+        return True
+
+    def reset(
+        self
+        ):
+        self._offset  = 0
+        self._partial = b""
+
+    def read_lines(
+        self
+        ):
+        """
+        Return a list of the complete lines appended since the previous read.
+        """
+        return [line for offset, line in self.read_lines_offsets()]
+
+    def read_lines_offsets(
+        self
+        ):
+        """
+        Return a list of the byte offset and text of each of the complete lines
+        appended since the previous read.
+        """
+        try:
+            status = os.stat(self._filepath)
+        except OSError:
+            return []
+        if self._inode is not None and status.st_ino != self._inode:
+            log.debug("{filepath} replaced -- read from start".format(
+                filepath = self._filepath
+            ))
+            self.reset()
+        elif status.st_size < self._offset:
+            log.debug("{filepath} truncated -- read from start".format(
+                filepath = self._filepath
+            ))
+            self.reset()
+        self._inode = status.st_ino
+        if status.st_size == self._offset:
+            return []
+        try:
+            with open(self._filepath, "rb") as file_text_out:
+                file_text_out.seek(self._offset)
+                data = file_text_out.read()
+        except (IOError, OSError):
+            return []
+        offset = self._offset - len(self._partial)
+        self._offset += len(data)
+        data = self._partial + data
+        lines = data.split(b"\n")
+        self._partial = lines.pop()
+        lines_offsets = []
+        for line in lines:
+            lines_offsets.append((offset, line.decode("utf-8", "replace")))
+            offset += len(line) + 1
+        return lines_offsets
+
+class MessageStore(object):
+
+    def __init__(
+        self,
+        maximum_count         = None,  # maximum number of messages
+        maximum_count_contact = 10000, # maximum number of messages per contact
+        maximum_age           = None   # s, maximum age of messages
+        ):
+        """
+        Store of received messages indexed by contact. All messages and the
+        messages of each contact are held in arrival order and unseen messages
+        are indexed separately, so that the latest (unseen) message of a contact
+        or all unseen messages are accessed without scanning every message
+        received. The oldest messages, seen or not, are evicted as messages are
+        added in order to keep within the retention limits specified.
+        """
+        self._lock               = threading.RLock()
+        self._count              = 0
+        self._messages           = collections.OrderedDict()
+        self._messages_contacts  = {}
+        self._unseen             = collections.OrderedDict()
+        self._unseen_contacts    = {}
+        self.set_retention(
+            maximum_count         = maximum_count,
+            maximum_count_contact = maximum_count_contact,
+            maximum_age           = maximum_age
+        )
+
+    def set_retention(
+        self,
+        maximum_count         = None, # maximum number of messages
+        maximum_count_contact = None, # maximum number of messages per contact
+        maximum_age           = None  # s, maximum age of messages
+        ):
+        with self._lock:
+            self._maximum_count         = maximum_count
+            self._maximum_count_contact = maximum_count_contact
+            self._maximum_age           = maximum_age
+            self.evict()
+
+    def _remove(
+        self,
+        message = None
+        ):
+        contact = message.contact(preserve_visibility = True)
+        self._messages.pop(message._index, None)
+        self.mark_seen(message)
+        if not self._messages_contacts[contact]:
+            del self._messages_contacts[contact]
+        if not self._unseen_contacts.get(contact, True):
+            del self._unseen_contacts[contact]
+        message._store = None
+
+    def evict(
+        self
+        ):
+        """
+        Remove the oldest messages exceeding the retention limits.
+        """
+        with self._lock:
+            if self._maximum_count_contact is not None:
+                for messages in list(self._messages_contacts.values()):
+                    while len(messages) > self._maximum_count_contact:
+                        self._remove(messages.popleft())
+            while self._messages:
+                message = next(iter(self._messages.values()))
+                if (
+                    self._maximum_count is not None and\
+                    len(self._messages) > self._maximum_count
+                ) or (
+                    self._maximum_age is not None and\
+                    time.time() - message.time() > self._maximum_age
+                ):
+                    # the oldest message is also the oldest of its contact
+                    self._messages_contacts[
+                        message.contact(preserve_visibility = True)
+                    ].popleft()
+                    self._remove(message)
+                else:
+                    break
+
+    def __len__(
+        self
+        ):
+        return len(self._messages)
+
+    def add(
+        self,
+        message = None
+        ):
+        with self._lock:
+            contact = message.contact(preserve_visibility = True)
+            message._store = self
+            message._index = self._count
+            self._count += 1
+            self._messages[message._index] = message
+            messages_contact = self._messages_contacts.setdefault(
+                contact,
+                collections.deque()
+            )
+            messages_contact.append(message)
+            if not message.seen():
+                self.mark_not_seen(message)
+            if self._maximum_count_contact is not None and\
+                len(messages_contact) > self._maximum_count_contact:
+                self._remove(messages_contact.popleft())
+            if self._maximum_count is not None or self._maximum_age is not None:
+                self.evict()
+
+    def mark_seen(
+        self,
+        message = None
+        ):
+        with self._lock:
+            self._unseen.pop(message._index, None)
+            unseen_contact = self._unseen_contacts.get(
+                message.contact(preserve_visibility = True)
             )
+            if unseen_contact is not None:
+                unseen_contact.pop(message._index, None)
+
+    def mark_not_seen(
+        self,
+        message = None
+        ):
+        with self._lock:
+            self._unseen[message._index] = message
+            self._unseen_contacts.setdefault(
+                message.contact(preserve_visibility = True),
+                collections.OrderedDict()
+            )[message._index] = message
+
+    def set_all_seen(
+        self
+        ):
+        with self._lock:
+            for message in list(self._unseen.values()):
+                message.set_seen()
+
+    def contacts(
+        self
+        ):
+        return list(self._messages_contacts.keys())
+
+    def next_index(
+        self
+        ):
+        """
+        Return the index that the next message added is to have.
+        """
+        return self._count
+
+    def messages_after(
+        self,
+        contact = None, # public key
+        index   = -1
+        ):
+        """
+        Return a list of the messages of a contact with an index greater than
+        the specified index, in arrival order.
+        """
+        with self._lock:
+            messages = []
+            for message in reversed(self._messages_contacts.get(contact, ())):
+                if message._index <= index:
+                    break
+                messages.append(message)
+            messages.reverse()
+            return messages
+
+    def cursor(
+        self,
+        contact     = None, # public key
+        offset_read = None  # byte offset read in text_out
+        ):
+        """
+        Return the byte offset in text_out of a contact up to which all messages
+        are seen and a list of the offsets of messages seen beyond it.
+        """
+        with self._lock:
+            unseen = self._unseen_contacts.get(contact)
+            if not unseen:
+                return offset_read, []
+            offset = next(iter(unseen.values()))._offset
+            seen = []
+            for message in reversed(self._messages_contacts[contact]):
+                if message._offset is None or message._offset <= offset:
+                    break
+                if message.seen():
+                    seen.append(message._offset)
+            return offset, sorted(seen)
+
+    def messages(
+        self,
+        contacts = None, # list of public keys
+        unseen   = False # unseen messages only
+        ):
+        """
+        Return a list of messages in arrival order, optionally of specified
+        contacts only and optionally unseen messages only.
+        """
+        with self._lock:
+            if self._maximum_age is not None:
+                self.evict()
+            if contacts is None:
+                if unseen:
+                    return list(self._unseen.values())
+                return list(self._messages.values())
+            index = self._unseen_contacts if unseen else self._messages_contacts
+            if len(contacts) == 1:
+                if unseen:
+                    return list(index.get(contacts[0], {}).values())
+                return list(index.get(contacts[0], ()))
+            messages = []
+            for contact in set(contacts):
+                if contact in index:
+                    if unseen:
+                        messages.extend(index[contact].values())
+                    else:
+                        messages.extend(index[contact])
+            return sorted(messages, key = lambda message: message._index)
+
+    def last_message(
+        self,
+        contacts = None, # list of public keys
+        unseen   = False # unseen messages only
+        ):
+        """
+        Return the latest message, optionally of specified contacts only and
+        optionally unseen only, or None if there is no such message.
+        """
+        with self._lock:
+            if self._maximum_age is not None:
+                self.evict()
+            if contacts is None:
+                index = {None: self._unseen if unseen else self._messages}
+            else:
+                index = self._unseen_contacts if unseen else self._messages_contacts
+                index = {contact: index.get(contact) for contact in contacts}
+            last = None
+            for messages in index.values():
+                if not messages:
+                    continue
+                if isinstance(messages, collections.deque):
+                    message = messages[-1]
+                else:
+                    message = next(reversed(messages.values()))
+                if last is None or message._index > last._index:
+                    last = message
+            return last
+
+class Watcher(object):
+
+    IN_MODIFY      = 0x00000002
+    IN_ATTRIB      = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ISDIR       = 0x40000000
+    IN_NONBLOCK    = 0x00000800
+    IN_CLOEXEC     = 0x00080000
+
+    def __init__(
+        self,
+        path                  = ".",
+        filenames             = (
+                                "call_state",
+                                "name",
+                                "online",
+                                "status",
+                                "text_out"
+                                ),
+        poll_interval_minimum = 0.05, # s
+        poll_interval_maximum = 1.0,  # s
+        use_inotify           = True
+        ):
+        """
+        Watch the ratox working directory for changes to contact directories,
+        to the specified files of each contact (such as `text_out` and
+        `call_state`) and to requests in `request/out`. Changes are detected
+        with inotify if it is available and otherwise by polling, with the poll
+        interval doubling from the minimum to the maximum while nothing changes.
+        Waiters are woken and callbacks are called with the list of changed
+        paths as soon as a change is detected.
+        """
+        self._path                  = os.path.abspath(path)
+        self._filenames             = set(filenames)
+        self._poll_interval_minimum = poll_interval_minimum
+        self._poll_interval_maximum = poll_interval_maximum
+        self._use_inotify           = use_inotify
+        self._condition             = threading.Condition()
+        self._generation            = 0
+        self._callbacks             = []
+        self._thread                = None
+        self._running               = False
+        self._inotify               = None
+        self._watches               = {}
+
+    def inotify(
+        self
+        ):
+        """
+        Return a boolean indicating whether changes are detected with inotify.
+        """
+        return self._inotify is not None
+
+    def generation(
+        self
+        ):
+        """
+        Return a counter incremented every time changes are detected.
+        """
+        return self._generation
+
+    def add_callback(
+        self,
+        function = None
+        ):
+        self._callbacks.append(function)
+
+    def remove_callback(
+        self,
+        function = None
+        ):
+        if function in self._callbacks:
+            self._callbacks.remove(function)
+
+    def start(
+        self
+        ):
+        if self._running:
+            return
+        self._running = True
+        if self._use_inotify:
+            self._inotify = self._inotify_init()
+        if self._inotify is not None:
+            target = self._run_inotify
         else:
-            log.error("error -- executable not found: {path}".format(path = path_ratox_executable))
-            sys.exit()
-        if pause:
-            # pause for connection to Tox network
-            time.sleep(pause_time)
+            log.debug("inotify unavailable -- poll for changes")
+            target = self._run_polling
+        self._thread = threading.Thread(target = target, name = "dendrotox_watcher")
+        self._thread.daemon = True
+        self._thread.start()
 
-def stop_messaging():
-    if running("ratox"):
-        engage_command(command = "killall ratox")
+    def stop(
+        self
+        ):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inotify is not None:
+            os.close(self._inotify[1])
+            self._inotify = None
+            self._watches = {}
 
-def restart_messaging(
-    path_ratox_executable = "/usr/local/bin/ratox"
-    ):
-    stop_messaging()
-    start_messaging(path_ratox_executable = path_ratox_executable)
+    def wait(
+        self,
+        generation = None,
+        timeout    = None  # s
+        ):
+        """
+        Wait until changes are detected after the specified generation (by
+        default, the current generation) or until the timeout and return the
+        generation reached. Passing the generation returned by the previous
+        wait ensures that no changes are missed between waits.
+        """
+        with self._condition:
+            if generation is None:
+                generation = self._generation
+            if timeout is None:
+                while self._generation == generation:
+                    self._condition.wait()
+            else:
+                time_stop = time.time() + timeout
+                while self._generation == generation:
+                    time_remaining = time_stop - time.time()
+                    if time_remaining <= 0:
+                        break
+                    self._condition.wait(time_remaining)
+            return self._generation
 
-def set_name(
-    text = "scriptwire"
-    ):
-    command = "echo \"{text}\" > name/in".format(text = text or "")
-    engage_command(command = command)
+    def _notify(
+        self,
+        paths = None
+        ):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+        for callback in list(self._callbacks):
+            try:
+                callback(paths)
+            except:
+                log.error("error -- watcher callback failed", exc_info = True)
 
-def set_state(
-    text = "available"
-    ):
-    """
-    options:
-    
-    - available
-    - away
-    - busy
-    - none
-    """
-    command = "echo \"{text}\" > state/in".format(text = text or "")
-    engage_command(command = command)
+    def _contact_directories(
+        self
+        ):
+        try:
+            directories = next(os.walk(self._path))[1]
+        except StopIteration:
+            return []
+        return [
+            directory for directory in directories\
+            if directory not in ratox_directories and\
+            os.path.isfile(os.path.join(self._path, directory, "status"))
+        ]
 
-def set_status(
-    text = "hello world"
-    ):
-    command = "echo \"{text}\" > status/in".format(text = text or "")
-    engage_command(command = command)
+    def _inotify_init(
+        self
+        ):
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(
+                ctypes.util.find_library("c") or "libc.so.6",
+                use_errno = True
+            )
+            file_descriptor = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (AttributeError, OSError):
+            return None
+        if file_descriptor < 0:
+            return None
+        self._inotify = (libc, file_descriptor)
+        mask_directory = self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_TO |\
+                         self.IN_MOVED_FROM
+        mask_contact   = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_CREATE |\
+                         self.IN_MOVED_TO | self.IN_DELETE_SELF | self.IN_ATTRIB
+        self._mask_contact   = mask_contact
+        self._mask_directory = mask_directory
+        if self._inotify_add_watch("", mask_directory) is None:
+            os.close(file_descriptor)
+            self._inotify = None
+            return None
+        self._inotify_watch_requests()
+        for directory in self._contact_directories():
+            self._inotify_add_watch(directory, mask_contact)
+        return self._inotify
 
-def send_request(
-    contact  = None, # Tox ID or public key
-    contacts = None, # list of Tox IDs or public keys
-    text     = "connection request"
-    ):
-    if contact:
-        contacts = [contact]
-    if contacts:
-        for contact in contacts:
-            if len(contact) == 76:
-                command = "echo \"{contact}\" \"{text}\" > request/in".format(
-                    contact = contact,
-                    text    = text or ""
+    def _inotify_watch_requests(
+        self
+        ):
+        """
+        Watch request/out, or request until it has out, if not watched already.
+        ratox creates them after launching, possibly after the watcher started.
+        Return a boolean indicating whether request/out was newly watched.
+        """
+        directories = set(self._watches.values())
+        if "request/out" in directories:
+            return False
+        if self._inotify_add_watch(
+            "request/out",
+            self._mask_directory | self.IN_MODIFY
+        ) is not None:
+            return True
+        if "request" not in directories:
+            self._inotify_add_watch("request", self._mask_directory)
+        return False
+
+    def _inotify_add_watch(
+        self,
+        directory = None,
+        mask      = None
+        ):
+        libc, file_descriptor = self._inotify
+        path = os.path.join(self._path, directory) if directory else self._path
+        watch_descriptor = libc.inotify_add_watch(
+            file_descriptor,
+            path.encode(sys.getfilesystemencoding()),
+            mask
+        )
+        if watch_descriptor < 0:
+            return None
+        self._watches[watch_descriptor] = directory
+        return watch_descriptor
+
+    def _run_inotify(
+        self
+        ):
+        header_size = struct.calcsize("iIII")
+        file_descriptor = self._inotify[1]
+        while self._running:
+            try:
+                readable = select.select([file_descriptor], [], [], 0.5)[0]
+            except (OSError, select.error):
+                readable = []
+            if not readable:
+                continue
+            try:
+                data = os.read(file_descriptor, 65536)
+            except OSError:
+                continue
+            paths  = []
+            offset = 0
+            while offset + header_size <= len(data):
+                watch_descriptor, mask, cookie, length = struct.unpack_from(
+                    "iIII",
+                    data,
+                    offset
+                )
+                filename = data[offset + header_size:offset + header_size + length]
+                filename = filename.rstrip(b"\0").decode(
+                    sys.getfilesystemencoding(),
+                    "replace"
                 )
+                offset += header_size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    paths.append(None)
+                    continue
+                if mask & self.IN_IGNORED:
+                    directory = self._watches.pop(watch_descriptor, None)
+                    if directory and directory not in ("request", "request/out"):
+                        # contact directory removed
+                        paths.append(directory)
+                    continue
+                directory = self._watches.get(watch_descriptor)
+                if directory is None:
+                    continue
+                if directory == "":
+                    if filename.startswith("."):
+                        # such as the ratox profile and dendrotox read state
+                        continue
+                    if self._inotify_watch_requests():
+                        paths.append("request/out")
+                    if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO) and\
+                        filename not in ratox_directories:
+                        # ratox creates the contact directory before its files
+                        self._inotify_add_watch(filename, self._mask_contact)
+                    paths.append(filename)
+                elif directory == "request":
+                    if self._inotify_watch_requests():
+                        paths.append("request/out")
+                elif directory == "request/out":
+                    paths.append(os.path.join(directory, filename))
+                elif not filename or filename in self._filenames:
+                    paths.append(os.path.join(directory, filename))
+            if paths:
+                self._notify(paths)
+
+    def _snapshot(
+        self
+        ):
+        snapshot = {}
+        for directory in ["", "request/out"]:
+            try:
+                snapshot[directory] = os.stat(
+                    os.path.join(self._path, directory)
+                ).st_mtime
+            except OSError:
+                pass
+        for directory in self._contact_directories():
+            for filename in self._filenames:
+                path = os.path.join(directory, filename)
                 try:
-                    engage_command(command = command)
-                except:
-                    pass
-            elif len(contact) == 64:
-                log.error("error -- invalid Tox ID -- possibly attempting to use only public key")
+                    status = os.stat(os.path.join(self._path, path))
+                except OSError:
+                    continue
+                snapshot[path] = (status.st_mtime, status.st_size)
+        return snapshot
+
+    def _run_polling(
+        self
+        ):
+        poll_interval = self._poll_interval_minimum
+        snapshot = self._snapshot()
+        while self._running:
+            time.sleep(poll_interval)
+            snapshot_new = self._snapshot()
+            paths = [
+                path for path in set(snapshot) | set(snapshot_new)\
+                if snapshot.get(path) != snapshot_new.get(path)
+            ]
+            snapshot = snapshot_new
+            if paths:
+                poll_interval = self._poll_interval_minimum
+                self._notify(paths)
             else:
-                log.error("error -- invalid Tox ID")
+                poll_interval = min(2 * poll_interval, self._poll_interval_maximum)
 
-def requests():
+class FIFOWriter(object):
+
+    def __init__(
+        self,
+        keep_open     = True,
+        timeout       = 5,    # s
+        poll_interval = 0.01  # s
+        ):
+        """
+        Write to ratox FIFOs in process. FIFOs are opened non-blocking, so that
+        a FIFO without a reader (ENXIO) or with a full buffer (EAGAIN) is retried
+        until the timeout rather than blocking indefinitely. Descriptors are
+        kept open for reuse by subsequent writes unless otherwise specified, and
+        are reopened if the FIFO is replaced or its reader goes away.
+        """
+        self._keep_open     = keep_open
+        self._timeout       = timeout
+        self._poll_interval = poll_interval
+        self._descriptors   = {}
+        self._locks         = {}
+        self._lock          = threading.Lock()
+
+    def _lock_filepath(
+        self,
+        filepath = None
+        ):
+        with self._lock:
+            if filepath not in self._locks:
+                self._locks[filepath] = threading.Lock()
+            return self._locks[filepath]
+
+    def _open(
+        self,
+        filepath  = None,
+        time_stop = None
+        ):
+        while True:
+            try:
+                return os.open(filepath, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as error:
+                # ENXIO: FIFO has no reader yet
+                if error.errno != errno.ENXIO or time.time() >= time_stop:
+                    raise
+            time.sleep(self._poll_interval)
+
+    def _descriptor(
+        self,
+        filepath  = None,
+        keep_open = True,
+        time_stop = None
+        ):
+        status = os.stat(filepath)
+        if not stat.S_ISFIFO(status.st_mode):
+            # regular file: replace its contents, as the shell redirection did
+            return os.open(filepath, os.O_WRONLY | os.O_TRUNC), False
+        if keep_open:
+            descriptor, inode = self._descriptors.get(filepath, (None, None))
+            if descriptor is not None and inode == status.st_ino:
+                return descriptor, True
+            if descriptor is not None:
+                self._close(filepath)
+        descriptor = self._open(filepath = filepath, time_stop = time_stop)
+        if keep_open:
+            self._descriptors[filepath] = (descriptor, status.st_ino)
+        return descriptor, keep_open
+
+    def _close(
+        self,
+        filepath = None
+        ):
+        descriptor, inode = self._descriptors.pop(filepath, (None, None))
+        if descriptor is not None:
+            try:
+                os.close(descriptor)
+            except OSError:
+                pass
+
+    def _write_all(
+        self,
+        descriptor = None,
+        data       = None,
+        timeout    = None
+        ):
+        # the timeout applies to each stall, so long copies can proceed
+        view = memoryview(data)
+        time_stop = time.time() + timeout
+        while view:
+            try:
+                view = view[os.write(descriptor, view):]
+                time_stop = time.time() + timeout
+                continue
+            except OSError as error:
+                if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            time_remaining = time_stop - time.time()
+            if time_remaining <= 0:
+                raise OSError(errno.EAGAIN, "FIFO write timed out")
+            select.select([], [descriptor], [], time_remaining)
+
+    def _pending(
+        self,
+        descriptor = None
+        ):
+        """
+        Return the number of bytes written to a FIFO and not yet read, or 0 if
+        it cannot be determined.
+        """
+        try:
+            return struct.unpack(
+                "i",
+                fcntl.ioctl(descriptor, termios.FIONREAD, b"\0" * 4)
+            )[0]
+        except (IOError, OSError):
+            return 0
+
+    def _drain(
+        self,
+        descriptor = None,
+        timeout    = None  # s
+        ):
+        """
+        Wait until the reader of a FIFO has read everything written to it or
+        until the timeout and return a boolean indicating whether it did.
+        """
+        time_stop = time.time() + timeout
+        while self._pending(descriptor):
+            if time.time() >= time_stop:
+                return False
+            time.sleep(self._poll_interval)
+        return True
+
+    def write(
+        self,
+        filepath  = None,
+        data      = None,  # bytes or text, file object or iterator of bytes
+        keep_open = None,
+        timeout   = None,  # s
+        rate      = None,  # bytes per second, for real-time pacing
+        lead      = 0.2,   # s, maximum pacing lead of data over real time
+        drain     = False  # write as a message read on its own by ratox
+        ):
+        """
+        Write data to a FIFO, raising OSError if it cannot be written before the
+        timeout. A file object or an iterator of chunks is streamed and the FIFO
+        is closed afterwards, signalling its end to ratox. If a rate is
+        specified, streaming is paced so that it keeps at most the lead time
+        ahead of real time. ratox makes a message of each read of text_in, so if
+        drain is specified, the data is written only once earlier data has been
+        read and the write waits for the data to be read, so that messages
+        written back to back are not merged.
+        """
+        if keep_open is None:
+            keep_open = self._keep_open
+        if timeout is None:
+            timeout = self._timeout
+        if hasattr(data, "read"):
+            chunks, keep_open = iter(lambda: data.read(65536), b""), False
+        elif hasattr(data, "__next__") or hasattr(data, "next"):
+            chunks, keep_open = data, False
+        else:
+            if not isinstance(data, bytes):
+                data = data.encode("utf-8")
+            chunks = [data]
+        time_stop = time.time() + timeout
+        with self._lock_filepath(filepath):
+            for attempt in range(2):
+                descriptor, kept = self._descriptor(
+                    filepath  = filepath,
+                    keep_open = keep_open,
+                    time_stop = time_stop
+                )
+                try:
+                    if drain and not self._drain(
+                        descriptor = descriptor,
+                        timeout    = timeout
+                    ):
+                        raise OSError(errno.EAGAIN, "FIFO not read before write")
+                    time_start = time.time()
+                    size       = 0
+                    for chunk in chunks:
+                        self._write_all(
+                            descriptor = descriptor,
+                            data       = chunk,
+                            timeout    = timeout
+                        )
+                        if rate:
+                            size += len(chunk)
+                            time_ahead = time_start + float(size) / rate - time.time()
+                            if time_ahead > lead:
+                                time.sleep(time_ahead - lead)
+                except OSError as error:
+                    if kept:
+                        self._close(filepath)
+                    else:
+                        os.close(descriptor)
+                    # EPIPE: reader of kept descriptor gone, so reopen once
+                    if not kept or error.errno != errno.EPIPE or attempt:
+                        raise
+                    continue
+                if drain and not self._drain(descriptor = descriptor, timeout = timeout):
+                    # written, so not an error, but the next write waits
+                    log.warning("warning -- {filepath} not read after {timeout} s".format(
+                        filepath = filepath,
+                        timeout  = timeout
+                    ))
+                if not kept:
+                    os.close(descriptor)
+                return True
+
+    def close(
+        self,
+        filepath = None
+        ):
+        """
+        Close the kept descriptor of a FIFO or, by default, of all FIFOs.
+        """
+        with self._lock:
+            filepaths = [filepath] if filepath else list(self._descriptors)
+        for filepath in filepaths:
+            with self._lock_filepath(filepath):
+                self._close(filepath)
+
+class TokenBucket(object):
+
+    def __init__(
+        self,
+        rate  = None, # tokens per second, None for unlimited
+        burst = 1     # maximum number of tokens
+        ):
+        """
+        Token bucket rate limit. It is not thread-safe and is used under the
+        lock of its owner.
+        """
+        self._rate   = rate
+        self._burst  = burst
+        self._tokens = float(burst)
+        self._time   = time.time()
+
+    def delay(
+        self
+        ):
+        """
+        Return the time in seconds until a token is available.
+        """
+        if self._rate is None:
+            return 0
+        time_now = time.time()
+        self._tokens = min(
+            self._burst,
+            self._tokens + (time_now - self._time) * self._rate
+        )
+        self._time = time_now
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def take(
+        self
+        ):
+        if self._rate is not None:
+            self._tokens -= 1
+
+class OutboundMessage(object):
+
+    __slots__ = [
+        "contact", "texts", "filepath", "priority", "future", "attempts",
+        "sent", "identifier"
+    ]
+
+    def __init__(
+        self,
+        contact  = None,
+        texts    = None, # list of chunks of text
+        filepath = None,
+        priority = False
+        ):
+        self.contact  = contact
+        self.texts    = texts or []
+        self.filepath = filepath
+        self.priority = priority
+        self.future   = concurrent.futures.Future()
+        self.attempts   = 0
+        self.sent       = 0    # number of chunks of text sent
+        self.identifier = None # in the outbox store
+
+class OutboxStore(object):
+
+    def __init__(
+        self,
+        filepath = ".dendrotox_outbox.sqlite"
+        ):
+        """
+        SQLite store of the messages of the outbound message queue that have
+        not yet been delivered, with the number of chunks of text of each that
+        have been sent. A message is added when it is queued, updated as its
+        chunks are sent and removed once delivered or abandoned, so that the
+        messages pending when a program exits are sent when it next starts.
+        """
+        import sqlite3
+        self._lock       = threading.Lock()
+        self._connection = sqlite3.connect(filepath, check_same_thread = False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "identifier INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "contact TEXT, "
+                "texts TEXT, "
+                "filepath TEXT, "
+                "priority INTEGER, "
+                "sent INTEGER"
+                ")"
+            )
+
+    def add(
+        self,
+        message = None
+        ):
+        """
+        Add a message and return its identifier.
+        """
+        with self._lock, self._connection:
+            return self._connection.execute(
+                "INSERT INTO outbox (contact, texts, filepath, priority, sent) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    message.contact,
+                    json.dumps(message.texts),
+                    message.filepath,
+                    int(message.priority),
+                    message.sent
+                )
+            ).lastrowid
+
+    def update(
+        self,
+        message = None
+        ):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE outbox SET sent = ? WHERE identifier = ?",
+                (message.sent, message.identifier)
+            )
+
+    def remove(
+        self,
+        message = None
+        ):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM outbox WHERE identifier = ?",
+                (message.identifier,)
+            )
+
+    def load(
+        self
+        ):
+        """
+        Return a list of the messages stored, in the order in which they were
+        queued.
+        """
+        with self._lock:
+            messages = []
+            for identifier, contact, texts, filepath, priority, sent in\
+                self._connection.execute(
+                    "SELECT identifier, contact, texts, filepath, priority, sent "
+                    "FROM outbox ORDER BY identifier"
+                ):
+                message = OutboundMessage(
+                    contact  = contact,
+                    texts    = json.loads(texts),
+                    filepath = filepath,
+                    priority = bool(priority)
+                )
+                message.identifier = identifier
+                message.sent       = sent
+                messages.append(message)
+            return messages
+
+    def close(
+        self
+        ):
+        with self._lock:
+            self._connection.close()
+
+class MessageQueue(object):
+
+    def __init__(
+        self,
+        rate            = None, # messages per second overall, None for unlimited
+        burst           = 10,
+        rate_contact    = None, # messages per second per contact, None for unlimited
+        burst_contact   = 5,
+        retries         = 5,
+        backoff         = 0.2,  # s, first retry delay, doubled for each retry
+        backoff_maximum = 10,   # s
+        timeout         = 1,    # s, per write attempt
+        workers         = 4,
+        store           = None  # outbox store of undelivered messages
+        ):
+        """
+        Queue of outbound messages between callers and the FIFOs of ratox.
+        Messages to a contact are sent in order, each contact being sent to by
+        one worker at a time while different contacts are sent to concurrently.
+        Sending is limited by a global token bucket and a token bucket per
+        contact. A write that fails because ratox is not reading (ENXIO) or is
+        busy (EAGAIN) is retried with exponential backoff, the message staying
+        at the head of the queue of its contact. High-priority messages, such as
+        alerts, are sent before normal messages. Each message has a future of a
+        boolean indicating delivery to ratox. If an outbox store is specified,
+        messages are kept in it until delivered or abandoned, and messages left
+        in it by a previous program are queued again, resuming from the first
+        chunk of text not sent.
+        """
+        self._rate_contact    = rate_contact
+        self._burst_contact   = burst_contact
+        self._retries         = retries
+        self._backoff         = backoff
+        self._backoff_maximum = backoff_maximum
+        self._timeout         = timeout
+        self._workers         = workers
+        self._bucket          = TokenBucket(rate = rate, burst = burst)
+        self._buckets         = {}
+        self._lanes           = {} # contact: [high-priority deque, normal deque]
+        self._busy            = set()
+        self._not_before      = {}
+        self._threads         = []
+        self._stopping        = False
+        self._condition       = threading.Condition()
+        self._store           = store
+        if store is not None:
+            messages = store.load()
+            if messages:
+                log.info("queue {count} undelivered messages".format(
+                    count = len(messages)
+                ))
+            for message in messages:
+                self._enqueue(message = message)
+
+    def start(
+        self
+        ):
+        with self._condition:
+            self._stopping = False
+            while len(self._threads) < self._workers:
+                thread = threading.Thread(
+                    target = self._run,
+                    name   = "dendrotox_send_{n}".format(n = len(self._threads))
+                )
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(
+        self,
+        wait = True # wait for queued messages to be sent
+        ):
+        with self._condition:
+            if wait:
+                while any(any(lanes) for lanes in self._lanes.values()):
+                    self._condition.wait()
+            self._stopping = True
+            threads, self._threads = self._threads, []
+            self._condition.notify_all()
+        for thread in threads:
+            thread.join()
+
+    def send(
+        self,
+        contact  = None,  # public key
+        text     = None,  # text to send
+        filepath = None,  # file to send
+        priority = False, # high priority
+        markers  = False  # prefix chunks of long text with sequence markers
+        ):
+        """
+        Queue text and/or a file for a contact and return a future of a boolean
+        indicating delivery. Text too long for a Tox message is split into
+        chunks which are sent back to back.
+        """
+        message = OutboundMessage(
+            contact  = contact,
+            texts    = split_text(text = text, markers = markers) if text else [],
+            filepath = filepath,
+            priority = priority
+        )
+        if self._store is not None:
+            try:
+                message.identifier = self._store.add(message = message)
+            except Exception as error:
+                log.error("error -- message to {contact} not stored: {error}".format(
+                    contact = contact,
+                    error   = error
+                ))
+        self._enqueue(message = message)
+        return message.future
+
+    def _enqueue(
+        self,
+        message = None
+        ):
+        self.start()
+        with self._condition:
+            if message.contact not in self._lanes:
+                self._lanes[message.contact] = [
+                    collections.deque(),
+                    collections.deque()
+                ]
+            self._lanes[message.contact][0 if message.priority else 1].append(message)
+            self._condition.notify()
+
+    def pending(
+        self,
+        contact = None # public key, by default all contacts
+        ):
+        """
+        Return the number of messages queued.
+        """
+        with self._condition:
+            if contact is not None:
+                return sum(len(lane) for lane in self._lanes.get(contact, []))
+            return sum(
+                len(lane) for lanes in self._lanes.values() for lane in lanes
+            )
+
+    def _next(
+        self
+        ):
+        """
+        Return the next message to send, or None and the time in seconds until
+        a message might be ready to send.
+        """
+        time_now  = time.time()
+        message   = None
+        delay_min = None
+        for contact, lanes in self._lanes.items():
+            if contact in self._busy or not any(lanes):
+                continue
+            bucket = self._buckets.get(contact)
+            if bucket is None:
+                bucket = self._buckets[contact] = TokenBucket(
+                    rate  = self._rate_contact,
+                    burst = self._burst_contact
+                )
+            delay = max(
+                self._not_before.get(contact, 0) - time_now,
+                bucket.delay()
+            )
+            if delay > 0:
+                if delay_min is None or delay < delay_min:
+                    delay_min = delay
+                continue
+            head = lanes[0][0] if lanes[0] else lanes[1][0]
+            if message is None or (head.priority and not message.priority):
+                message = head
+                if head.priority:
+                    break
+        if message is None:
+            return None, delay_min
+        delay = self._bucket.delay()
+        if delay > 0:
+            return None, delay
+        self._bucket.take()
+        self._buckets[message.contact].take()
+        return message, None
+
+    def _write(
+        self,
+        message = None
+        ):
+        # a retry resumes from the first chunk not sent
+        while message.sent < len(message.texts):
+            fifo_writer.write(
+                filepath = "{contact}/text_in".format(contact = message.contact),
+                data     = message.texts[message.sent] + "\n",
+                timeout  = self._timeout,
+                drain    = True
+            )
+            message.sent += 1
+            self._store_call("update", message)
+        if message.filepath:
+            with open(message.filepath, "rb") as file_send:
+                fifo_writer.write(
+                    filepath = "{contact}/file_in".format(contact = message.contact),
+                    data     = file_send,
+                    timeout  = self._timeout
+                )
+
+    def _run(
+        self
+        ):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopping:
+                        return
+                    message, delay = self._next()
+                    if message is not None:
+                        break
+                    self._condition.wait(delay)
+                self._busy.add(message.contact)
+            if message.attempts or message.future.set_running_or_notify_cancel():
+                try:
+                    self._write(message = message)
+                    result = True
+                except (IOError, OSError) as error:
+                    result = None
+                    if error.errno not in (
+                        errno.ENXIO, errno.EAGAIN, errno.EWOULDBLOCK, errno.EPIPE
+                    ) or message.attempts >= self._retries:
+                        log.error("error -- message to {contact} not sent: {error}".format(
+                            contact = message.contact,
+                            error   = error
+                        ))
+                        result = False
+            else:
+                # cancelled before sending
+                result = False
+            with self._condition:
+                self._busy.discard(message.contact)
+                lanes = self._lanes[message.contact]
+                if result is None:
+                    self._not_before[message.contact] = time.time() + min(
+                        self._backoff * 2 ** message.attempts,
+                        self._backoff_maximum
+                    )
+                    message.attempts += 1
+                else:
+                    lanes[0 if message.priority else 1].popleft()
+                    self._not_before.pop(message.contact, None)
+                    if not any(lanes):
+                        del self._lanes[message.contact]
+                self._condition.notify_all()
+            if result is not None:
+                self._store_call("remove", message)
+                if not message.future.cancelled():
+                    message.future.set_result(result)
+
+    def _store_call(
+        self,
+        method  = None, # name of an outbox store method
+        message = None
+        ):
+        if self._store is None or message.identifier is None:
+            return
+        try:
+            getattr(self._store, method)(message = message)
+        except Exception as error:
+            log.error("error -- outbox store {method} failed: {error}".format(
+                method = method,
+                error  = error
+            ))
+
+class DeferredMessage(object):
+
+    __slots__ = [
+        "contact", "text", "filepath", "priority", "collapse", "time_expiry",
+        "markers", "future"
+    ]
+
+    def __init__(
+        self,
+        contact     = None,
+        text        = None,
+        filepath    = None,
+        priority    = False,
+        collapse    = None,
+        time_expiry = None,
+        markers     = False
+        ):
+        self.contact     = contact
+        self.text        = text
+        self.filepath    = filepath
+        self.priority    = priority
+        self.collapse    = collapse
+        self.time_expiry = time_expiry
+        self.markers     = markers
+        self.future      = concurrent.futures.Future()
+
+class DeferredDelivery(object):
+
+    def __init__(
+        self,
+        message_queue = None,
+        watcher       = None
+        ):
+        """
+        Presence-aware delivery of messages. A message to a contact that is not
+        online is held in a pending queue of the contact until the online file
+        of the contact changes to 1, at which point the pending queue is passed
+        to the outbound message queue in order. A message can have a time to
+        live, after which it is dropped, and a collapse key, a pending message
+        replacing any pending message of the same key for the contact, such as
+        to keep only the latest status. Each message has a future of a boolean
+        indicating delivery.
+        """
+        self._message_queue = message_queue
+        self._watcher       = watcher
+        self._pending       = {}
+        self._lock          = threading.Lock()
+        self._wake          = threading.Event()
+        self._thread        = None
+
+    def start(
+        self
+        ):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._watcher.add_callback(self._notify)
+            self._thread = threading.Thread(
+                target = self._run,
+                name   = "dendrotox_deferred"
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def send(
+        self,
+        contact  = None,  # public key
+        text     = None,  # text to send
+        filepath = None,  # file to send
+        priority = False, # high priority
+        ttl      = None,  # s, time to live while pending, None for unlimited
+        collapse = None,  # key of messages of which only the latest is kept
+        markers  = False  # prefix chunks of long text with sequence markers
+        ):
+        """
+        Send text and/or a file to a contact when the contact is online and
+        return a future of a boolean indicating delivery.
+        """
+        message = DeferredMessage(
+            contact     = contact,
+            text        = text,
+            filepath    = filepath,
+            priority    = priority,
+            collapse    = collapse,
+            time_expiry = None if ttl is None else time.time() + ttl,
+            markers     = markers
+        )
+        self.start()
+        replaced = []
+        with self._lock:
+            pending = self._pending.setdefault(contact, [])
+            if collapse is not None:
+                replaced = [item for item in pending if item.collapse == collapse]
+                pending[:] = [item for item in pending if item.collapse != collapse]
+            pending.append(message)
+        for item in replaced:
+            item.future.set_result(False)
+        self._wake.set()
+        return message.future
+
+    def pending(
+        self,
+        contact = None # public key, by default all contacts
+        ):
+        """
+        Return the number of messages pending.
+        """
+        with self._lock:
+            if contact is not None:
+                return len(self._pending.get(contact, []))
+            return sum(len(pending) for pending in self._pending.values())
+
+    def _notify(
+        self,
+        paths = None
+        ):
+        if paths is None or None in paths or any(
+            path.endswith("/online") for path in paths
+        ):
+            self._wake.set()
+
+    def _forward(
+        self,
+        message = None
+        ):
+        future = self._message_queue.send(
+            contact  = message.contact,
+            text     = message.text,
+            filepath = message.filepath,
+            priority = message.priority,
+            markers  = message.markers
+        )
+        def done(future):
+            if future.cancelled():
+                message.future.set_result(False)
+            else:
+                message.future.set_result(future.result())
+        future.add_done_callback(done)
+
+    def _run(
+        self
+        ):
+        while True:
+            self._wake.clear()
+            time_now = time.time()
+            expired  = []
+            ready    = []
+            with self._lock:
+                for contact in list(self._pending):
+                    pending = self._pending[contact]
+                    expired.extend(
+                        item for item in pending\
+                        if item.time_expiry is not None and item.time_expiry <= time_now
+                    )
+                    pending[:] = [
+                        item for item in pending\
+                        if item.time_expiry is None or item.time_expiry > time_now
+                    ]
+                    if pending and contact_registry.online(contact = contact):
+                        ready.extend(pending)
+                        pending[:] = []
+                    if not pending:
+                        del self._pending[contact]
+                times_expiry = [
+                    item.time_expiry for pending in self._pending.values()\
+                    for item in pending if item.time_expiry is not None
+                ]
+            for item in expired:
+                log.warning("warning -- message to {contact} expired undelivered".format(
+                    contact = item.contact
+                ))
+                item.future.set_result(False)
+            for item in ready:
+                self._forward(message = item)
+            timeout = None
+            if times_expiry:
+                timeout = max(0, min(times_expiry) - time.time())
+            self._wake.wait(timeout)
+
+class ContactRegistry(object):
+
+    def __init__(
+        self,
+        path = "."
+        ):
+        """
+        Cache of the contacts at the ratox working directory and of their files,
+        such as name, status and online flag. The listing of contacts is reread
+        only when the modification time of the working directory changes and a
+        file is reread only when its modification time or size changes. While
+        an inotify watcher is attached, the cache is instead invalidated by its
+        events, so that cached values are returned without any system calls.
+        """
+        self._path        = path
+        self._lock        = threading.RLock()
+        self._mtime       = None
+        self._contacts    = []
+        self._pending     = []
+        self._files       = {}
+        self._watcher     = None
+
+    def attach(
+        self,
+        watcher = None
+        ):
+        with self._lock:
+            self._watcher = watcher
+            self._mtime   = None
+            self._files   = {}
+        watcher.add_callback(self.invalidate)
+
+    def _trusted(
+        self
+        ):
+        return self._watcher is not None and self._watcher.inotify()
+
+    def invalidate(
+        self,
+        paths = None
+        ):
+        with self._lock:
+            if paths is None or None in paths:
+                self._mtime = None
+                self._files = {}
+                return
+            for path in paths:
+                directory, separator, filename = path.partition("/")
+                if not filename or directory not in self._contacts:
+                    # directory created, removed or moved, or unknown contact
+                    self._mtime = None
+                if not filename:
+                    for path_file in list(self._files):
+                        if path_file.startswith(directory + "/"):
+                            del self._files[path_file]
+                self._files.pop(path, None)
+
+    def contacts(
+        self
+        ):
+        """
+        Return a list of contacts by collating all directories at the working
+        directory that are not ratox directories and contain a file `status`.
+        """
+        with self._lock:
+            if self._mtime is None or not self._trusted():
+                mtime = os.stat(self._path).st_mtime
+                if mtime != self._mtime:
+                    self._mtime    = mtime
+                    self._contacts = []
+                    self._pending  = [
+                        directory for directory in next(os.walk(self._path))[1]\
+                        if directory not in ratox_directories
+                    ]
+            # ratox creates a contact directory before its files
+            if self._pending:
+                contacts = [
+                    directory for directory in self._pending\
+                    if os.path.isfile(os.path.join(self._path, directory, "status"))
+                ]
+                if contacts:
+                    self._contacts.extend(contacts)
+                    self._pending = [
+                        directory for directory in self._pending\
+                        if directory not in contacts
+                    ]
+            return list(self._contacts)
+
+    def read(
+        self,
+        contact  = None, # public key
+        filename = None
+        ):
+        """
+        Return the first line of a file of a contact, or None if it cannot be
+        read.
+        """
+        path = "{contact}/{filename}".format(contact = contact, filename = filename)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and self._trusted():
+                return cached[1]
+            try:
+                status = os.stat(os.path.join(self._path, path))
+            except OSError:
+                self._files.pop(path, None)
+                return None
+            stamp = (status.st_mtime, status.st_size)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            try:
+                with open(os.path.join(self._path, path)) as file_contact:
+                    value = file_contact.readline().rstrip("\n")
+            except (IOError, OSError):
+                return None
+            self._files[path] = (stamp, value)
+            return value
+
+    def name(
+        self,
+        contact = None # public key
+        ):
+        return self.read(contact = contact, filename = "name")
+
+    def status(
+        self,
+        contact = None # public key
+        ):
+        return self.read(contact = contact, filename = "status")
+
+    def online(
+        self,
+        contact = None # public key
+        ):
+        return self.read(contact = contact, filename = "online") == "1"
+
+    def information(
+        self,
+        contact = None # public key
+        ):
+        return {
+            "public_key": contact,
+            "name":       self.name(contact = contact),
+            "status":     self.status(contact = contact),
+            "online":     self.online(contact = contact)
+        }
+
+class ProcessManager(object):
+
+    def __init__(
+        self,
+        program  = "ratox",
+        filepath = ".ratox.pid"
+        ):
+        """
+        Launch and track a single instance of a program. The process launched
+        is recorded by its handle and in a pidfile, so that its liveness is
+        checked through `/proc/<pid>` without launching a process and so that
+        only that instance is stopped, including by a later session.
+        """
+        self._program  = program
+        self._filepath = filepath
+        self._process  = None
+
+    def start(
+        self,
+        command = None # list of program and arguments
+        ):
+        self._process = subprocess.Popen(command)
+        try:
+            with open(self._filepath, "w") as file_pid:
+                file_pid.write("{pid}\n".format(pid = self._process.pid))
+        except (IOError, OSError):
+            log.warning("warning -- pidfile {filepath} not written".format(
+                filepath = self._filepath
+            ))
+        return self._process
+
+    def pid(
+        self
+        ):
+        """
+        Return the process ID of the instance launched, or None.
+        """
+        if self._process is not None:
+            return self._process.pid
+        try:
+            with open(self._filepath) as file_pid:
+                return int(file_pid.readline())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def running(
+        self
+        ):
+        """
+        Return a boolean indicating whether the instance launched is running.
+        """
+        if self._process is not None:
+            # poll reaps the child if it has exited
+            return self._process.poll() is None
+        pid = self.pid()
+        return pid is not None and process_running(pid = pid, program = self._program)
+
+    def stop(
+        self,
+        timeout = 5 # s
+        ):
+        """
+        Terminate the instance launched, killing it if it has not exited by the
+        timeout. Return a boolean indicating whether an instance was stopped.
+        """
+        pid = self.pid()
+        stopped = False
+        if pid is not None and self.running():
+            log.info("stop {program} (PID {pid})".format(
+                program = self._program,
+                pid     = pid
+            ))
+            try:
+                os.kill(pid, signal.SIGTERM)
+                time_stop = time.time() + timeout
+                while self.running() and time.time() < time_stop:
+                    time.sleep(0.05)
+                if self.running():
+                    os.kill(pid, signal.SIGKILL)
+                stopped = True
+            except OSError:
+                pass
+            if self._process is not None:
+                try:
+                    self._process.wait(timeout = timeout)
+                except:
+                    pass
+        self._process = None
+        try:
+            os.remove(self._filepath)
+        except OSError:
+            pass
+        return stopped
+
+class Consumer(object):
+
+    def __init__(
+        self,
+        name  = None,
+        store = None,
+        start = "latest" # "latest" or "earliest" message
+        ):
+        """
+        Named reader of the messages of a store, which keeps its own read
+        position for each contact, so that several consumers can read the same
+        messages independently of each other and of the seen flags of messages.
+        """
+        self._name      = name
+        self._store     = store
+        self._lock      = threading.Lock()
+        self._positions = {}
+        if start == "earliest":
+            self._start = -1
+        else:
+            self._start = store.next_index() - 1
+
+    def name(
+        self
+        ):
+        return self._name
+
+    def position(
+        self,
+        contact = None # public key
+        ):
+        """
+        Return the index of the last message of a contact read.
+        """
+        return self._positions.get(contact, self._start)
+
+    def seek(
+        self,
+        contact = None, # public key
+        index   = -1
+        ):
+        with self._lock:
+            self._positions[contact] = index
+
+    def messages(
+        self,
+        contacts = None, # list of public keys
+        advance  = True  # advance read positions past messages returned
+        ):
+        """
+        Return a list of the messages not yet read by the consumer, optionally
+        of specified contacts only, in arrival order.
+        """
+        with self._lock:
+            if contacts is None:
+                contacts = self._store.contacts()
+            messages = []
+            for contact in set(contacts):
+                messages_contact = self._store.messages_after(
+                    contact = contact,
+                    index   = self._positions.get(contact, self._start)
+                )
+                if messages_contact:
+                    messages.extend(messages_contact)
+                    if advance:
+                        self._positions[contact] = messages_contact[-1]._index
+            return sorted(messages, key = lambda message: message._index)
+
+class ReadStateStore(object):
+
+    def __init__(
+        self,
+        filepath = ".dendrotox_state.sqlite"
+        ):
+        """
+        SQLite store of the read state of each contact: the inode of its
+        text_out, the byte offset up to which all messages are seen and the
+        offsets of any messages seen beyond that offset. It is loaded in one
+        query at startup, so that reading resumes where it stopped without
+        rescanning text_out, and messages received while stopped are unseen.
+        """
+        import sqlite3
+        self._lock       = threading.Lock()
+        self._saved      = {}
+        self._connection = sqlite3.connect(filepath, check_same_thread = False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cursors ("
+                "contact TEXT PRIMARY KEY, "
+                "inode INTEGER, "
+                "offset INTEGER, "
+                "seen TEXT"
+                ")"
+            )
+
+    def load(
+        self
+        ):
+        """
+        Return a dictionary of the inode, offset and set of seen offsets of each
+        contact.
+        """
+        with self._lock:
+            states = {}
+            for contact, inode, offset, seen in self._connection.execute(
+                "SELECT contact, inode, offset, seen FROM cursors"
+            ):
+                self._saved[contact] = (inode, offset, seen)
+                states[contact] = {
+                    "inode":  inode,
+                    "offset": offset,
+                    "seen":   set(int(offset) for offset in seen.split())
+                }
+            return states
+
+    def save(
+        self,
+        states = None # dictionary of inode, offset and seen offsets of contacts
+        ):
+        """
+        Save the states of contacts that have changed since they were last saved.
+        """
+        with self._lock:
+            rows = []
+            for contact, (inode, offset, seen) in states.items():
+                state = (inode, offset, " ".join(str(offset) for offset in seen))
+                if self._saved.get(contact) != state:
+                    self._saved[contact] = state
+                    rows.append((contact,) + state)
+            if rows:
+                with self._connection:
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO cursors VALUES (?, ?, ?, ?)",
+                        rows
+                    )
+
+    def close(
+        self
+        ):
+        with self._lock:
+            self._connection.close()
+
+class SpeechEngine(object):
+
+    def __init__(
+        self,
+        command = ["festival", "--pipe"],
+        workers = 1,  # maximum number of concurrent syntheses
+        timeout = 60  # s, per synthesis
+        ):
+        """
+        Pool of long-lived festival processes which synthesize speech to WAVE
+        files on request, so that synthesis does not pay the startup cost of
+        festival. Requests are queued and served by the number of workers
+        specified, each with its own festival process. Completion is signalled
+        by festival writing the request number to a FIFO. A process that fails
+        or times out is replaced for the next request.
+        """
+        self._command = command
+        self._workers = workers
+        self._timeout = timeout
+        self._queue   = queue.Queue()
+        self._threads = []
+        self._count   = 0
+        self._lock    = threading.Lock()
+
+    def start(
+        self
+        ):
+        with self._lock:
+            while len(self._threads) < self._workers:
+                thread = threading.Thread(
+                    target = self._run,
+                    name   = "dendrotox_speech_{n}".format(n = len(self._threads))
+                )
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(
+        self
+        ):
+        with self._lock:
+            for thread in self._threads:
+                self._queue.put(None)
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(self._timeout)
+
+    def synthesize(
+        self,
+        text = None
+        ):
+        """
+        Queue speech synthesis of text and return a future of the path of the
+        WAVE file synthesized.
+        """
+        future = concurrent.futures.Future()
+        self.start()
+        self._queue.put((text, future))
+        return future
+
+    def _run(
+        self
+        ):
+        import tempfile
+        directory = tempfile.mkdtemp(prefix = "dendrotox_speech_")
+        filepath_done = os.path.join(directory, "done")
+        os.mkfifo(filepath_done)
+        # a writer is held open so that the reader does not see end of file
+        done      = os.open(filepath_done, os.O_RDONLY | os.O_NONBLOCK)
+        done_hold = os.open(filepath_done, os.O_WRONLY | os.O_NONBLOCK)
+        process   = None
+        try:
+            while True:
+                request = self._queue.get()
+                if request is None:
+                    break
+                text, future = request
+                if not future.set_running_or_notify_cancel():
+                    continue
+                with self._lock:
+                    self._count += 1
+                    number = self._count
+                filepath = None
+                try:
+                    if process is None or process.poll() is not None:
+                        process = subprocess.Popen(
+                            self._command,
+                            stdin  = subprocess.PIPE,
+                            stdout = open(os.devnull, "wb"),
+                            stderr = open(os.devnull, "wb")
+                        )
+                        process.stdin.write(b"(Parameter.set 'Wavefiletype 'riff)\n")
+                    descriptor, filepath = tempfile.mkstemp(suffix = ".wav")
+                    os.close(descriptor)
+                    process.stdin.write((
+                        "(begin "
+                        "(utt.save.wave (SynthText \"{text}\") \"{filepath}\" 'riff) "
+                        "(set! dendrotox_done (fopen \"{done}\" \"w\")) "
+                        "(format dendrotox_done \"{number}\\n\") "
+                        "(fclose dendrotox_done))\n"
+                    ).format(
+                        text     = text.replace("\\", "\\\\").replace("\"", "\\\""),
+                        filepath = filepath,
+                        done     = filepath_done,
+                        number   = number
+                    ).encode("utf-8"))
+                    process.stdin.flush()
+                    self._wait(
+                        descriptor = done,
+                        number     = number,
+                        process    = process
+                    )
+                    future.set_result(filepath)
+                except Exception as error:
+                    log.error("error -- speech synthesis failed: {error}".format(
+                        error = error
+                    ))
+                    if process is not None and process.poll() is None:
+                        process.kill()
+                    process = None
+                    if filepath is not None and os.path.exists(filepath):
+                        os.remove(filepath)
+                    future.set_exception(error)
+        finally:
+            if process is not None and process.poll() is None:
+                process.stdin.close()
+                process.kill()
+            os.close(done)
+            os.close(done_hold)
+            os.remove(filepath_done)
+            os.rmdir(directory)
+
+    def _wait(
+        self,
+        descriptor = None,
+        number     = None,
+        process    = None
+        ):
+        time_stop = time.time() + self._timeout
+        data = b""
+        while True:
+            lines = data.split(b"\n")
+            if str(number).encode() in lines[:-1]:
+                return
+            time_remaining = time_stop - time.time()
+            if time_remaining <= 0:
+                raise OSError(errno.ETIMEDOUT, "speech synthesis timed out")
+            if process.poll() is not None:
+                raise OSError(errno.EPIPE, "speech program exited")
+            if select.select([descriptor], [], [], min(0.1, time_remaining))[0]:
+                try:
+                    data = lines[-1] + os.read(descriptor, 4096)
+                except OSError as error:
+                    if error.errno != errno.EAGAIN:
+                        raise
+
+class SpeechCache(object):
+
+    def __init__(
+        self,
+        directory    = None,
+        maximum_size = 100 * 1024 ** 2 # bytes
+        ):
+        """
+        On-disk least-recently-used cache of synthesized speech, stored as the
+        mono signed 16-bit little-endian PCM, with silence appended, that is
+        streamed to calls. Entries are addressed by a hash of the text, the
+        speech program, the sample rate and the silence duration, and the least
+        recently used entries are removed while the cache exceeds its maximum
+        size.
+        """
+        if directory is None:
+            directory = os.path.join(
+                os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                "dendrotox",
+                "speech"
+            )
+        self._directory    = directory
+        self._maximum_size = maximum_size
+        self._lock         = threading.Lock()
+
+    def directory(
+        self
+        ):
+        return self._directory
+
+    def filepath(
+        self,
+        text               = None,
+        preference_program = "festival",
+        sample_rate        = 48000,
+        silence            = 3000        # ms
+        ):
+        key = hashlib.sha256(json.dumps(
+            [text, preference_program, sample_rate, silence]
+        ).encode("utf-8")).hexdigest()
+        return os.path.join(self._directory, key + ".pcm")
+
+    def get(
+        self,
+        text               = None,
+        preference_program = "festival",
+        sample_rate        = 48000,
+        silence            = 3000        # ms
+        ):
+        """
+        Return the path of the cached PCM of the speech, or None if it is not
+        cached.
+        """
+        filepath = self.filepath(
+            text               = text,
+            preference_program = preference_program,
+            sample_rate        = sample_rate,
+            silence            = silence
+        )
+        try:
+            # record use
+            os.utime(filepath, None)
+        except OSError:
+            return None
+        return filepath
+
+    def synthesize(
+        self,
+        text               = None,
+        preference_program = "festival",
+        sample_rate        = 48000,
+        silence            = 3000        # ms
+        ):
+        """
+        Return the path of the PCM of the speech, synthesizing and caching it if
+        it is not cached. Raise ImportError if NumPy is unavailable.
+        """
+        filepath = self.get(
+            text               = text,
+            preference_program = preference_program,
+            sample_rate        = sample_rate,
+            silence            = silence
+        )
+        if filepath is not None:
+            log.debug("speech cache hit: {text}".format(text = text))
+            return filepath
+        import numpy
+        filepath = self.filepath(
+            text               = text,
+            preference_program = preference_program,
+            sample_rate        = sample_rate,
+            silence            = silence
+        )
+        filepath_WAVE = synthesize_speech(
+            text               = text,
+            preference_program = preference_program
+        )
+        if not filepath_WAVE:
+            return None
+        filepath_tmp = "{filepath}.{pid}.{thread}.tmp".format(
+            filepath = filepath,
+            pid      = os.getpid(),
+            thread   = threading.current_thread().ident
+        )
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            with open(filepath_tmp, "wb") as file_PCM:
+                for chunk in WAVE_PCM_chunks(
+                    filepath    = filepath_WAVE,
+                    sample_rate = sample_rate
+                ):
+                    file_PCM.write(chunk)
+                file_PCM.write(b"\x00" * (2 * int(sample_rate * silence / 1000.0)))
+            os.rename(filepath_tmp, filepath)
+        except:
+            # evict considers only complete entries, so remove partial ones
+            if os.path.exists(filepath_tmp):
+                os.remove(filepath_tmp)
+            raise
+        finally:
+            os.remove(filepath_WAVE)
+        self.evict()
+        return filepath
+
+    def evict(
+        self
+        ):
+        """
+        Remove the least recently used entries while the cache exceeds its
+        maximum size.
+        """
+        with self._lock:
+            entries = []
+            for filename in os.listdir(self._directory):
+                if not filename.endswith(".pcm"):
+                    continue
+                try:
+                    status = os.stat(os.path.join(self._directory, filename))
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, filename))
+            size = sum(entry[1] for entry in entries)
+            for mtime, size_entry, filename in sorted(entries):
+                if size <= self._maximum_size:
+                    break
+                try:
+                    os.remove(os.path.join(self._directory, filename))
+                    size -= size_entry
+                except OSError:
+                    pass
+
+class CallReceiver(object):
+
+    def __init__(
+        self,
+        contact           = None,  # public key
+        sample_rate       = 48000,
+        filepath          = None,  # WAVE file to record to
+        speaker           = False, # play to speakers with aplay
+        callback          = None,  # function called with each chunk of PCM
+        silence_threshold = 0.05,  # RMS, fraction of full scale
+        silence_duration  = 10,    # s, of silence after which to stop, None for never
+        block_duration    = 0.02,  # s, of blocks of which RMS is computed
+        timeout           = None,  # s, maximum wait for the call to be answered
+        call              = None   # call session to mark active on answering
+        ):
+        """
+        Receive the sound of a call from call_out in process, writing it to a
+        WAVE file, speakers and a callback simultaneously. The RMS of each block
+        of the sound is computed with NumPy to detect silence: leading silence
+        and trailing silence are trimmed from the file and callback, and
+        receiving is stopped on detection of silence of the duration specified.
+        Speakers are sent the sound untrimmed as it is received.
+        """
+        import numpy
+        self._numpy             = numpy
+        self._contact           = contact
+        self._sample_rate       = sample_rate
+        self._filepath          = filepath
+        self._speaker           = speaker
+        self._callback          = callback
+        self._silence_threshold = silence_threshold
+        self._silence_duration  = silence_duration
+        self._block_size        = max(1, int(sample_rate * block_duration))
+        self._timeout           = timeout
+        self._call              = call
+        self._cancelled         = threading.Event()
+        self.bytes_received     = 0
+
+    def cancel(
+        self
+        ):
+        self._cancelled.set()
+
+    def _silent_blocks(
+        self,
+        data = None
+        ):
+        """
+        Return an array of a boolean for each block of PCM indicating whether its
+        RMS is below the silence threshold.
+        """
+        numpy = self._numpy
+        samples = numpy.frombuffer(data, "<i2").reshape(-1, self._block_size)
+        samples = samples / 32768.0
+        RMS = numpy.sqrt(numpy.mean(samples * samples, axis = 1))
+        return RMS < self._silence_threshold
+
+    def receive(
+        self
+        ):
+        """
+        Receive the call until the contact hangs up, silence of the duration
+        specified is detected or the receiving is cancelled. Return False if the
+        call is not answered within the timeout.
+        """
+        filepath_FIFO = "{contact}/call_out".format(contact = self._contact)
+        try:
+            FIFO = os.open(filepath_FIFO, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError as error:
+            log.error("error -- {filepath}: {error}".format(
+                filepath = filepath_FIFO,
+                error    = error
+            ))
+            return False
+        file_WAVE = None
+        player    = None
+        if self._filepath:
+            file_WAVE = wave.open(os.path.expanduser(self._filepath), "wb")
+            file_WAVE.setnchannels(1)
+            file_WAVE.setsampwidth(2)
+            file_WAVE.setframerate(self._sample_rate)
+        if self._speaker:
+            player = subprocess.Popen(
+                [
+                    "aplay", "-q", "-r", str(self._sample_rate), "-c", "1",
+                    "-f", "S16_LE", "-"
+                ],
+                stdin = subprocess.PIPE
+            )
+        def record(data):
+            if file_WAVE:
+                file_WAVE.writeframes(data)
+            if self._callback:
+                self._callback(data)
+        block_bytes    = 2 * self._block_size
+        blocks_silence = None
+        if self._silence_duration is not None:
+            blocks_silence = max(1, int(
+                self._silence_duration * self._sample_rate / self._block_size
+            ))
+        buffer_        = b""
+        silence        = []    # blocks of current silence, held until sound
+        count_silence  = 0     # number of blocks of current silence
+        voiced         = False # whether sound has been detected
+        time_start     = time.time()
+        try:
+            while not self._cancelled.is_set():
+                if not self.bytes_received and self._timeout is not None and\
+                    time.time() - time_start > self._timeout:
+                    log.error("error -- call not answered: {contact}".format(
+                        contact = self._contact
+                    ))
+                    return False
+                ready, _, _ = select.select([FIFO], [], [], 0.2)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(FIFO, 65536)
+                except OSError as error:
+                    if error.errno == errno.EAGAIN:
+                        continue
+                    raise
+                if not data:
+                    if self.bytes_received:
+                        # contact hung up
+                        break
+                    time.sleep(0.05)
+                    continue
+                if not self.bytes_received and self._call is not None:
+                    self._call._set_state("active")
+                self.bytes_received += len(data)
+                if player:
+                    try:
+                        player.stdin.write(data)
+                    except IOError:
+                        player = None
+                buffer_ += data
+                size = len(buffer_) - len(buffer_) % block_bytes
+                if not size:
+                    continue
+                data, buffer_ = buffer_[:size], buffer_[size:]
+                stop = False
+                for index, silent in enumerate(self._silent_blocks(data)):
+                    block = data[index * block_bytes:(index + 1) * block_bytes]
+                    if not silent:
+                        if silence:
+                            record(b"".join(silence))
+                        silence       = []
+                        count_silence = 0
+                        voiced        = True
+                        record(block)
+                        continue
+                    if voiced:
+                        silence.append(block)
+                    count_silence += 1
+                    if blocks_silence and count_silence >= blocks_silence:
+                        stop = True
+                        break
+                if stop:
+                    log.debug("silence detected -- stop receiving call")
+                    break
+        finally:
+            os.close(FIFO)
+            if file_WAVE:
+                file_WAVE.close()
+            if player:
+                try:
+                    player.stdin.close()
+                except IOError:
+                    pass
+                player.wait()
+        return True
+
+class Microphone(object):
+
+    def __init__(
+        self,
+        sample_rate    = 48000,
+        chunk_duration = 0.1,   # s
+        buffer_chunks  = 5      # chunks held for a stream not being read
+        ):
+        """
+        Capture of the microphone by a single arecord process, the sound of
+        which is fanned out to any number of streams, such as the streams of
+        concurrent calls. Capture starts with the first stream and stops when
+        the last stream is closed. A stream that is not being read, such as that
+        of a call not yet answered, holds only the latest chunks, so that the
+        sound it yields stays live.
+        """
+        self._sample_rate   = sample_rate
+        self._chunk_size    = 2 * max(1, int(sample_rate * chunk_duration))
+        self._buffer_chunks = buffer_chunks
+        self._streams       = []
+        self._process       = None
+        self._thread        = None
+        self._lock          = threading.Lock()
+
+    def stream(
+        self,
+        duration = None # s, of sound after which the stream ends, None for never
+        ):
+        """
+        Return a new stream of the sound of the microphone, starting capture if
+        it is not running.
+        """
+        stream = MicrophoneStream(
+            microphone    = self,
+            sample_rate   = self._sample_rate,
+            duration      = duration,
+            buffer_chunks = self._buffer_chunks
+        )
+        with self._lock:
+            self._streams.append(stream)
+            if self._process is None:
+                self._process = subprocess.Popen(
+                    [
+                        "arecord", "-q", "-t", "raw", "-r", str(self._sample_rate),
+                        "-c", "1", "-f", "S16_LE"
+                    ],
+                    stdout = subprocess.PIPE
+                )
+                self._thread = threading.Thread(
+                    target = self._run,
+                    args   = (self._process,),
+                    name   = "dendrotox_microphone"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+        return stream
+
+    def remove(
+        self,
+        stream = None
+        ):
+        with self._lock:
+            if stream in self._streams:
+                self._streams.remove(stream)
+            if self._streams or self._process is None:
+                return
+            process, self._process = self._process, None
+        # the process launched by this capture only
+        process.terminate()
+
+    def stop(
+        self
+        ):
+        with self._lock:
+            streams = list(self._streams)
+        for stream in streams:
+            stream.cancel()
+
+    def _run(
+        self,
+        process = None
+        ):
+        try:
+            while True:
+                chunk = process.stdout.read(self._chunk_size)
+                if not chunk:
+                    break
+                with self._lock:
+                    streams = list(self._streams)
+                for stream in streams:
+                    stream._put(chunk)
+        finally:
+            process.stdout.close()
+            process.wait()
+            streams = []
+            with self._lock:
+                # capture ended other than by removal of the last stream
+                if self._process is process:
+                    self._process = None
+                    streams = list(self._streams)
+            for stream in streams:
+                stream._put(None)
+
+class MicrophoneStream(object):
+
+    def __init__(
+        self,
+        microphone    = None,
+        sample_rate   = 48000,
+        duration      = None, # s
+        buffer_chunks = 5
+        ):
+        """
+        Iterator of chunks of the sound of a microphone capture, as mono signed
+        16-bit little-endian PCM. Iteration ends after the duration specified,
+        at the end of capture or on cancellation.
+        """
+        self._microphone     = microphone
+        self._queue          = queue.Queue(maxsize = buffer_chunks)
+        self._cancelled      = threading.Event()
+        self._size_remaining = None
+        if duration is not None:
+            self._size_remaining = 2 * int(sample_rate * duration)
+        self.bytes_streamed  = 0
+
+    def _put(
+        self,
+        chunk = None
+        ):
+        while True:
+            try:
+                self._queue.put_nowait(chunk)
+                return
+            except queue.Full:
+                # drop the oldest chunk
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def cancel(
+        self
+        ):
+        self._cancelled.set()
+        self._put(None)
+        self._microphone.remove(stream = self)
+
+    def close(
+        self
+        ):
+        self._microphone.remove(stream = self)
+
+    def __iter__(
+        self
+        ):
+        try:
+            while not self._cancelled.is_set():
+                if self._size_remaining is not None and self._size_remaining <= 0:
+                    break
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                if self._size_remaining is not None:
+                    chunk = chunk[:self._size_remaining]
+                    self._size_remaining -= len(chunk)
+                self.bytes_streamed += len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+class Call(object):
+
+    def __init__(
+        self,
+        contact   = None,      # public key
+        direction = "outgoing" # outgoing or incoming
+        ):
+        """
+        Session of a call, tracking its state (pending, active or ended) from
+        the call_state file of the contact and from its sound stream. A call
+        becomes active when call_state indicates that it has been answered or,
+        for an incoming call, when its sound is first received. It becomes
+        ended when the sound stream finishes or the contact hangs up, at which
+        point its FIFO and worker are freed. A call is true if its sound was
+        written to ratox successfully, which does not mean that it was answered,
+        as ratox reads call_in whether or not a call is answered; whether a call
+        was answered is returned by answered.
+        """
+        self.contact      = contact
+        self.direction    = direction
+        self.result       = None
+        self.time_start   = time.time()
+        self.time_answer  = None
+        self.time_end     = None
+        self._state       = "pending"
+        self._bytes       = 0
+        self._receiver    = None
+        self._stream      = None
+        self._watcher     = None
+        self._cancelled   = threading.Event()
+        self._condition   = threading.Condition()
+
+    def __bool__(
+        self
+        ):
+        return bool(self.result)
+
+    __nonzero__ = __bool__
+
+    def __repr__(
+        self
+        ):
+        return "Call({contact}, {direction}, {state})".format(
+            contact   = self.contact,
+            direction = self.direction,
+            state     = self._state
+        )
+
+    def state(
+        self
+        ):
+        return self._state
+
+    def bytes_streamed(
+        self
+        ):
+        if self._receiver is not None:
+            return self._receiver.bytes_received
+        return self._bytes
+
+    def answered(
+        self
+        ):
+        """
+        Return a boolean indicating whether the call has been answered, that
+        is, has reached the active state.
+        """
+        return self.time_answer is not None
+
+    def time_to_answer(
+        self
+        ):
+        """
+        Return the time in seconds between the call starting and it being
+        answered, or None if it has not been answered.
+        """
+        if self.time_answer is None:
+            return None
+        return self.time_answer - self.time_start
+
+    def wait(
+        self,
+        timeout = None # s
+        ):
+        """
+        Wait until the call has ended or until the timeout and return a boolean
+        indicating whether the call has ended.
+        """
+        with self._condition:
+            if timeout is None:
+                while self._state != "ended":
+                    self._condition.wait()
+            else:
+                time_stop = time.time() + timeout
+                while self._state != "ended":
+                    time_remaining = time_stop - time.time()
+                    if time_remaining <= 0:
+                        break
+                    self._condition.wait(time_remaining)
+            return self._state == "ended"
+
+    def cancel(
+        self
+        ):
+        """
+        Stop streaming the sound of the call.
+        """
+        self._cancelled.set()
+        if self._receiver is not None:
+            self._receiver.cancel()
+        if self._stream is not None:
+            self._stream.cancel()
+
+    def _set_state(
+        self,
+        state = None
+        ):
+        with self._condition:
+            if self._state == "ended" or self._state == state:
+                return
+            if state == "active":
+                self.time_answer = time.time()
+            elif state == "ended":
+                self.time_end = time.time()
+            self._state = state
+            self._condition.notify_all()
+        log.debug("call {contact}: {state}".format(
+            contact = self.contact,
+            state   = state
+        ))
+
+    def _update(
+        self,
+        paths = None
+        ):
+        """
+        Update the state of the call from the call_state file of the contact.
+        """
+        path = "{contact}/call_state".format(contact = self.contact)
+        if paths is not None and None not in paths and path not in paths:
+            return
+        call_state = contact_registry.read(
+            contact  = self.contact,
+            filename = "call_state"
+        )
+        if call_state == "active":
+            self._set_state("active")
+        elif self._state == "active" and call_state not in (None, "pending"):
+            # the contact hung up
+            self.cancel()
+
+    def _chunks(
+        self,
+        chunks = None # iterator of chunks of sound
+        ):
+        """
+        Return an iterator of the chunks of sound, counting the bytes streamed
+        and ending when the call is cancelled. ratox holds the FIFO of the call
+        open whether or not the contact has answered, so reading the iterator
+        does not indicate answering, which is instead taken from call_state.
+        """
+        size = 0
+        for chunk in chunks:
+            self._bytes += size
+            if self._cancelled.is_set():
+                return
+            size = len(chunk)
+            yield chunk
+        self._bytes += size
+
+    def _run(
+        self,
+        function   = None, # function returning a boolean indicating success
+        watcher    = None,
+        background = False
+        ):
+        """
+        Run the function streaming the sound of the call, in a thread if
+        background, and track the state of the call until it has ended.
+        """
+        self._watcher = watcher
+        if watcher is not None:
+            watcher.add_callback(self._update)
+            # the call may have been answered before the callback was added
+            self._update()
+        def run():
+            try:
+                self.result = function()
+            except:
+                log.error("error -- call {contact}".format(contact = self.contact), exc_info = True)
+                self.result = False
+            finally:
+                if self._watcher is not None:
+                    self._watcher.remove_callback(self._update)
+                self._set_state("ended")
+        if background:
+            thread = threading.Thread(
+                target = run,
+                name   = "dendrotox_call_{contact}".format(contact = self.contact[:8])
+            )
+            thread.daemon = True
+            thread.start()
+        else:
+            run()
+        return self
+
+class CallManager(object):
+
+    def __init__(
+        self,
+        handler = None, # function called with the public key of a calling contact
+        workers = 4,    # maximum number of concurrent calls
+        watcher = None
+        ):
+        """
+        Dispatcher of incoming calls. Changes of call state are detected by the
+        watcher and each pending call is handled by the handler specified in a
+        worker of its own. Calls beyond the maximum number of concurrent calls
+        are left pending until a worker is free. A handler normally answers the
+        call using receive_call.
+        """
+        self._handler  = handler
+        self._workers  = workers
+        self._watcher  = watcher
+        self._executor = None
+        self._thread   = None
+        self._active   = {}
+        self._lock     = threading.Lock()
+        self._wake     = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(
+        self
+        ):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = self._workers
+        )
+        self._watcher.add_callback(self._notify)
+        self._thread = threading.Thread(
+            target = self._run,
+            name   = "dendrotox_calls"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(
+        self,
+        wait = True # wait for calls being handled to finish
+        ):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._watcher.remove_callback(self._notify)
+        self._executor.shutdown(wait = wait)
+
+    def active(
+        self
+        ):
+        """
+        Return a list of the contacts of the calls being handled.
+        """
+        with self._lock:
+            return list(self._active)
+
+    def _notify(
+        self,
+        paths = None
+        ):
+        if paths is None or None in paths or any(
+            path.endswith("/call_state") for path in paths
+        ):
+            self._wake.set()
+
+    def _done(
+        self,
+        contact = None
+        ):
+        def done(future):
+            with self._lock:
+                self._active.pop(contact, None)
+            if future.exception() is not None:
+                log.error("error -- call handler: {contact}: {error}".format(
+                    contact = contact,
+                    error   = future.exception()
+                ))
+            self._wake.set()
+        return done
+
+    def _run(
+        self
+        ):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            for contact in get_contacts_calling():
+                with self._lock:
+                    if contact in self._active or\
+                        len(self._active) >= self._workers:
+                        continue
+                    log.info("handle call: {contact}".format(contact = contact))
+                    future = self._executor.submit(self._handler, contact)
+                    self._active[contact] = future
+                future.add_done_callback(self._done(contact = contact))
+            self._wake.wait(1)
+
+global message_store
+message_store = MessageStore()
+
+global text_out_tails
+text_out_tails = {}
+
+global event_watcher
+event_watcher = None
+
+global fifo_writer
+fifo_writer = FIFOWriter()
+
+global message_queue
+message_queue = None
+
+global outbox_filepath
+outbox_filepath = ".dendrotox_outbox.sqlite"
+
+global deferred_delivery
+deferred_delivery = None
+
+global contact_registry
+contact_registry = ContactRegistry()
+
+global self_ID_cache
+self_ID_cache = (None, None)
+
+global ratox_process
+ratox_process = ProcessManager(program = "ratox")
+
+global history_loaded
+history_loaded = False
+
+global consumers
+consumers = {}
+
+global call_manager
+call_manager = None
+
+global microphone
+microphone = None
+
+global read_state_filepath
+read_state_filepath = ".dendrotox_state.sqlite"
+
+global read_state_store
+read_state_store = None
+
+global read_state_time
+read_state_time = 0
+
+# executables required by features, each requirement being a list of
+# alternatives; calls stream sound files in process, and the other executables
+# are required only by the sources and sinks of sound that use them
+capability_requirements = {
+    "text":       [],
+    "calls":      [],
+    "speech":     [["text2wave"], ["festival"]],
+    "microphone": [["arecord"]], # sending calls from the microphone
+    "speaker":    [["aplay"]],   # receiving calls to speakers
+    "recording":  [["rec"]],     # receiving calls to file without NumPy (SoX)
+    "conversion": [["ffmpeg"]]   # sending calls from sound files other than PCM WAVE
+}
+
+global capabilities
+capabilities = {}
+
+global speech_cache
+speech_cache = None
+
+global speech_engine
+speech_engine = None
+
+ratox_directories = [
+    "conf",
+    "name",
+    "nospam",
+    "request",
+    "state",
+    "status"
+]
+
+# bytes, maximum size of a Tox message (TOX_MAX_MESSAGE_LENGTH), including the
+# newline terminating it at text_in
+maximum_message_size = 1372
+
+def self_ID():
+    """
+    Return the Tox ID, rereading the file `id` only if it has changed.
+    """
+    global self_ID_cache
+    try:
+        status = os.stat("id")
+        stamp = (status.st_mtime, status.st_size)
+        if stamp != self_ID_cache[0]:
+            self_ID_cache = (stamp, [line.rstrip("\n") for line in open("id")][0])
+        return self_ID_cache[1]
+    except:
+        log.error("error -- ratox not running?")
+
+def start_messaging(
+    path_ratox_executable = "/usr/local/bin/ratox",
+    launch                = True,
+    pause                 = True,
+    pause_time            = 20,           # s, maximum wait for readiness
+    contacts              = None,         # list of Tox IDs or public keys, or "all"
+    features              = ["text"],     # features required (see capable)
+    log_level             = logging.INFO
+    ):
+    """
+    Launch ratox if it is not running and, if pause is specified, wait until it
+    is ready (see wait_until_ready) for up to the pause time. The program exits
+    if the executables required by the specified features are not available.
+    """
+    log.setLevel(log_level)
+    for feature in features or []:
+        if not capable(feature):
+            sys.exit()
+    if not running("ratox"):
+        if os.path.isfile(path_ratox_executable) and launch:
+            log.info("launch ratox")
+            ratox_process.start(command = [path_ratox_executable])
+        else:
+            log.error("error -- executable not found: {path}".format(path = path_ratox_executable))
+            sys.exit()
+    if pause:
+        # pause for connection to Tox network
+        if not wait_until_ready(contacts = contacts, timeout = pause_time):
+            log.warning("warning -- ratox not ready after {pause_time} s".format(
+                pause_time = pause_time
+            ))
+
+def ready(
+    contacts    = None, # list of Tox IDs or public keys, or "all"
+    require_all = True  # require all contacts online rather than any
+    ):
+    """
+    Return a boolean indicating whether ratox is ready: the file `id` exists,
+    the FIFOs of ratox exist and the specified contacts are online.
+    """
+    if not os.path.isfile("id"):
+        return False
+    for filepath in ["name/in", "request/in", "state/in", "status/in"]:
+        if not os.path.exists(filepath):
+            return False
+    if not contacts:
+        return True
+    if contacts == "all":
+        contacts = all_contacts()
+        if not contacts:
+            return True
+    contacts = [contact[:64] for contact in contacts]
+    contacts_online = [
+        os.path.exists(contact + "/text_in") and contact_online(contact = contact)\
+        for contact in contacts
+    ]
+    if require_all:
+        return all(contacts_online)
+    return any(contacts_online)
+
+def wait_until_ready(
+    contacts    = None, # list of Tox IDs or public keys, or "all"
+    require_all = True, # require all contacts online rather than any
+    timeout     = 60    # s
+    ):
+    """
+    Wait until ratox is ready (see ready), waking on changes to the working
+    directory, and return a boolean indicating whether it became ready before
+    the timeout.
+    """
+    watcher   = get_watcher()
+    time_stop = time.time() + timeout
+    while True:
+        generation = watcher.generation()
+        if ready(contacts = contacts, require_all = require_all):
+            return True
+        time_remaining = time_stop - time.time()
+        if time_remaining <= 0:
+            return False
+        # not all signals are watched (such as FIFOs in ratox directories)
+        watcher.wait(generation = generation, timeout = min(0.1, time_remaining))
+
+def capable(
+    feature = None # a key of capability_requirements, such as "calls"
+    ):
+    """
+    Return a boolean indicating whether the executables required by a feature
+    are available, logging any that are missing. The result is probed on first
+    use and cached.
+    """
+    global capabilities
+    if feature not in capabilities:
+        available = True
+        for alternatives in capability_requirements[feature]:
+            if not any(which(executable) for executable in alternatives):
+                log.error("error -- executable not found: {executable}".format(
+                    executable = " or ".join(alternatives)
+                ))
+                available = False
+        capabilities[feature] = available
+    return capabilities[feature]
+
+def stop_messaging():
+    """
+    Stop the instance of ratox launched by start_messaging. An instance of ratox
+    launched otherwise is not stopped.
+    """
+    stop_handling_calls(wait = False)
+    fifo_writer.close()
+    if not ratox_process.stop() and running("ratox"):
+        log.warning("warning -- ratox not launched by dendrotox -- not stopped")
+
+def restart_messaging(
+    path_ratox_executable = "/usr/local/bin/ratox"
+    ):
+    stop_messaging()
+    start_messaging(path_ratox_executable = path_ratox_executable)
+
+def write_FIFO(
+    filepath  = None,
+    text      = None, # text to write as a line
+    data      = None, # bytes, file object or iterator of bytes to write
+    keep_open = None,
+    timeout   = None, # s
+    rate      = None  # bytes per second, for real-time pacing
+    ):
+    """
+    Write a line of text or data to a ratox FIFO without launching a process.
+    A line of text is written as a message of its own, waiting for ratox to
+    read it. Return a boolean indicating success.
+    """
+    global fifo_writer
+    if text is not None:
+        data = text + "\n"
+    try:
+        return fifo_writer.write(
+            filepath  = filepath,
+            data      = data,
+            keep_open = keep_open,
+            timeout   = timeout,
+            rate      = rate,
+            drain     = text is not None
+        )
+    except (IOError, OSError) as error:
+        log.error("error -- write to {filepath} failed: {error}".format(
+            filepath = filepath,
+            error    = error
+        ))
+        return False
+
+def set_name(
+    text = "scriptwire"
+    ):
+    write_FIFO(filepath = "name/in", text = text or "")
+
+def set_state(
+    text = "available"
+    ):
+    """
+    options:
+    
+    - available
+    - away
+    - busy
+    - none
+    """
+    write_FIFO(filepath = "state/in", text = text or "")
+
+def set_status(
+    text = "hello world"
+    ):
+    write_FIFO(filepath = "status/in", text = text or "")
+
+def send_request(
+    contact  = None, # Tox ID or public key
+    contacts = None, # list of Tox IDs or public keys
+    text     = "connection request"
+    ):
+    if contact:
+        contacts = [contact]
+    if contacts:
+        for contact in contacts:
+            if len(contact) == 76:
+                write_FIFO(
+                    filepath = "request/in",
+                    text     = "{contact} {text}".format(
+                        contact = contact,
+                        text    = text or ""
+                    )
+                )
+            elif len(contact) == 64:
+                log.error("error -- invalid Tox ID -- possibly attempting to use only public key")
+            else:
+                log.error("error -- invalid Tox ID")
+
+def requests():
     """
     Return a list of contacts who have sent requests.
     """
@@ -325,190 +3454,631 @@ def accept_request(
     if contacts == "all":
         contacts = requests()
     for contact in contacts:
-        command = "echo 1 > request/out/{contact}".format(contact = contact)
+        write_FIFO(
+            filepath  = "request/out/{contact}".format(contact = contact),
+            text      = "1",
+            keep_open = False
+        )
+
+def remove(
+    contact              = None, # Tox ID or public key
+    contacts             = None, # list of Tox IDs or public keys
+    Tox_ID_to_public_key = True
+    ):
+    if contact:
+        contacts = [contact]
+    if contacts == "all":
+        contacts = all_contacts()
+    if contacts:
+        if Tox_ID_to_public_key:
+            contacts = [contact[:64] for contact in contacts]
+        for contact in contacts:
+            write_FIFO(
+                filepath  = "{contact}/remove".format(contact = contact),
+                text      = "1",
+                keep_open = False
+            )
+            fifo_writer.close("{contact}/text_in".format(contact = contact))
+
+def run_for_contacts(
+    function = None,
+    contacts = None, # list of public keys
+    workers  = 16,   # maximum number of concurrent calls
+    **kwargs
+    ):
+    """
+    Call a function with each of a list of contacts, concurrently over a bounded
+    pool of threads, and return a dictionary of the result for each contact. The
+    result for a contact for which the function raises an exception is False.
+    """
+    results = {}
+    if not contacts:
+        return results
+    def run(contact):
         try:
-            engage_command(command = command)
+            return function(contact = contact, **kwargs)
         except:
-            pass
+            log.error("error -- {contact}".format(contact = contact), exc_info = True)
+            return False
+    if len(contacts) == 1 or workers <= 1:
+        for contact in contacts:
+            results[contact] = run(contact)
+        return results
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers = min(workers, len(contacts))
+    ) as executor:
+        futures = dict(
+            (executor.submit(run, contact), contact) for contact in contacts
+        )
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+def _split_UTF8(
+    data = None, # UTF-8 bytes
+    size = None  # bytes, maximum size of a chunk
+    ):
+    if size < 1:
+        raise ValueError("chunk size {size} smaller than a character".format(
+            size = size
+        ))
+    chunks = []
+    while len(data) > size:
+        index = data.rfind(b"\n", 0, size + 1)
+        if index > 0:
+            chunks.append(data[:index])
+            data = data[index + 1:]
+            continue
+        # back off from UTF-8 continuation bytes
+        index = size
+        while index > 0 and bytearray(data[index:index + 1])[0] & 0xC0 == 0x80:
+            index -= 1
+        if index == 0:
+            raise ValueError("chunk size {size} smaller than a character".format(
+                size = size
+            ))
+        chunks.append(data[:index])
+        data = data[index:]
+    chunks.append(data)
+    return chunks
+
+def split_text(
+    text         = None,
+    maximum_size = None,  # bytes, by default the Tox message limit
+    markers      = False  # prefix chunks with sequence markers, such as [2/5]
+    ):
+    """
+    Split text into a list of chunks which each fit in a Tox message, breaking
+    at lines where possible and otherwise at UTF-8 character boundaries. Text
+    which fits in a message is returned as a single chunk without a marker.
+    Bytes are decoded as UTF-8. Raise ValueError if the maximum size cannot fit
+    a character of the text.
+    """
+    if maximum_size is None:
+        maximum_size = maximum_message_size - 1
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    data = text.encode("utf-8")
+    if len(data) <= maximum_size:
+        return [text]
+    count = 1
+    while True:
+        size = maximum_size
+        if markers:
+            size -= len("[{count}/{count}] ".format(count = count))
+        chunks = _split_UTF8(data = data, size = size)
+        if not markers or len(str(len(chunks))) <= len(str(count)):
+            break
+        count = len(chunks)
+    chunks = [chunk.decode("utf-8") for chunk in chunks]
+    if markers:
+        chunks = [
+            u"[{index}/{count}] {chunk}".format(
+                index = index + 1,
+                count = len(chunks),
+                chunk = chunk
+            ) for index, chunk in enumerate(chunks)
+        ]
+    return chunks
+
+def send_message_contact(
+    contact  = None,  # public key
+    text     = None,  # text to send
+    filepath = None,  # file to send
+    timeout  = None,  # s, per FIFO write
+    markers  = False  # prefix chunks of long text with sequence markers
+    ):
+    """
+    Send text and/or a file to a contact. Text too long for a Tox message is
+    split into chunks which are sent back to back. Return a boolean indicating
+    success.
+    """
+    if not os.path.exists(contact):
+        log.error("error -- contact {contact} not found".format(contact = contact))
+        return False
+    success = True
+    if text:
+        for chunk in split_text(text = text, markers = markers):
+            success = write_FIFO(
+                filepath = "{contact}/text_in".format(contact = contact),
+                text     = chunk,
+                timeout  = timeout
+            ) and success
+            if not success:
+                break
+    if filepath:
+        if os.path.exists(filepath):
+            with open(filepath, "rb") as file_send:
+                success = write_FIFO(
+                    filepath = "{contact}/file_in".format(contact = contact),
+                    data     = file_send,
+                    timeout  = timeout
+                ) and success
+        else:
+            log.error("error -- {filepath} not found".format(filepath = filepath))
+            success = False
+    return success
+
+def send_message(
+    contact              = None, # Tox ID or public key
+    contacts             = None, # list of Tox IDs or public keys
+    text                 = None, # text to send
+    filepath             = None, # file to send
+    Tox_ID_to_public_key = True,
+    workers              = 16,   # maximum number of concurrent sends
+    timeout              = None, # s, per FIFO write
+    markers              = False # prefix chunks of long text with sequence markers
+    ):
+    """
+    Send text and/or a file to a contact or contacts. Multiple contacts are sent
+    to concurrently, so that a slow contact does not hold up the others. Text
+    too long for a Tox message is split into chunks. Return a dictionary of a
+    boolean indicating success for each contact.
+    """
+    if contact:
+        contacts = [contact]
+    if contacts == "all":
+        contacts = all_contacts()
+    if not contacts:
+        log.error("error -- no contacts specified")
+        return {}
+    if Tox_ID_to_public_key:
+        contacts = [contact[:64] for contact in contacts]
+    return run_for_contacts(
+        function = send_message_contact,
+        contacts = contacts,
+        workers  = workers,
+        text     = text,
+        filepath = filepath,
+        timeout  = timeout,
+        markers  = markers
+    )
+
+def get_message_queue(
+    **kwargs # MessageQueue options, used when the queue is created
+    ):
+    """
+    Return the outbound message queue, creating it if it does not exist. Its
+    undelivered messages are kept at the path outbox_filepath, unless it is
+    None, and are sent when the queue is next created.
+    """
+    global message_queue
+    if message_queue is None:
+        store = None
+        if outbox_filepath:
+            try:
+                store = OutboxStore(filepath = outbox_filepath)
+            except Exception as error:
+                log.error("error -- outbox {filepath} not opened: {error}".format(
+                    filepath = outbox_filepath,
+                    error    = error
+                ))
+        kwargs.setdefault("store", store)
+        message_queue = MessageQueue(**kwargs)
+    return message_queue
+
+def get_deferred_delivery():
+    """
+    Return the presence-aware deferred delivery, creating it if it does not
+    exist.
+    """
+    global deferred_delivery
+    if deferred_delivery is None:
+        deferred_delivery = DeferredDelivery(
+            message_queue = get_message_queue(),
+            watcher       = get_watcher()
+        )
+    return deferred_delivery
+
+def queue_message(
+    contact              = None,  # Tox ID or public key
+    contacts             = None,  # list of Tox IDs or public keys
+    text                 = None,  # text to send
+    filepath             = None,  # file to send
+    Tox_ID_to_public_key = True,
+    priority             = False, # high priority, such as for alerts
+    when_online          = False, # hold until the contact is online
+    ttl                  = None,  # s, time to live while held, None for unlimited
+    collapse             = None,  # key of held messages of which only the latest is kept
+    markers              = False  # prefix chunks of long text with sequence markers
+    ):
+    """
+    Queue text and/or a file for a contact or contacts without waiting for it to
+    be sent. Return a dictionary of a future of a boolean indicating delivery
+    for each contact. Messages are sent in order for each contact, subject to
+    the rate limits of the outbound message queue, and are retried while ratox
+    is not reading. If specified, messages are held until their contact is
+    online and are sent as soon as it comes online.
+    """
+    if contact:
+        contacts = [contact]
+    if contacts == "all":
+        contacts = all_contacts()
+    if not contacts:
+        log.error("error -- no contacts specified")
+        return {}
+    if Tox_ID_to_public_key:
+        contacts = [contact[:64] for contact in contacts]
+    if when_online:
+        delivery = get_deferred_delivery()
+        return dict(
+            (
+                contact,
+                delivery.send(
+                    contact  = contact,
+                    text     = text,
+                    filepath = filepath,
+                    priority = priority,
+                    ttl      = ttl,
+                    collapse = collapse,
+                    markers  = markers
+                )
+            ) for contact in contacts
+        )
+    queue_outbound = get_message_queue()
+    return dict(
+        (
+            contact,
+            queue_outbound.send(
+                contact  = contact,
+                text     = text,
+                filepath = filepath,
+                priority = priority,
+                markers  = markers
+            )
+        ) for contact in contacts
+    )
+
+def send_request_and_message_contact(
+    contact  = None, # Tox ID
+    text     = None, # text to send
+    filepath = None, # file to send
+    timeout  = None  # s, per FIFO write
+    ):
+    if len(contact) == 76:
+        send_request(contact = contact)
+    return send_message_contact(
+        contact  = contact[:64],
+        text     = text,
+        filepath = filepath,
+        timeout  = timeout
+    )
+
+def send_request_and_message(
+    contact  = None, # Tox ID or public key
+    contacts = None, # list of Tox IDs or public keys
+    text     = None, # text to send
+    filepath = None, # file to send
+    workers  = 16,   # maximum number of concurrent sends
+    timeout  = None  # s, per FIFO write
+    ):
+    """
+    Send a request followed by text and/or a file to a contact or contacts
+    concurrently. Requests are sent only for contacts specified by Tox ID, as
+    contacts specified by public key are contacts already. Return a dictionary
+    of a boolean indicating message sending success for each contact.
+    """
+    if contact:
+        contacts = [contact]
+    if contacts == "all":
+        contacts = all_contacts()
+    if not contacts:
+        log.error("error -- no contacts specified")
+        return {}
+    return run_for_contacts(
+        function = send_request_and_message_contact,
+        contacts = contacts,
+        workers  = workers,
+        text     = text,
+        filepath = filepath,
+        timeout  = timeout
+    )
+
+def send_self_ID(
+    contact  = None, # Tox ID or public key
+    contacts = None  # list of Tox IDs or public keys
+    ):
+    send_message(
+        contact  = contact,
+        contacts = contacts,
+        text     = self_ID()
+    )
+
+def all_contacts():
+    """
+    Return a list of contacts by collating all directories at the working
+    directory that are not ratox directories and contain a file `status`.
+    """
+    return contact_registry.contacts()
+
+def contact_information(
+    contact              = None, # Tox ID or public key
+    Tox_ID_to_public_key = True
+    ):
+    """
+    Return a dictionary of the public key, name, status and online flag of a
+    contact.
+    """
+    if Tox_ID_to_public_key:
+        contact = contact[:64]
+    return contact_registry.information(contact = contact)
+
+def contact_online(
+    contact              = None, # Tox ID or public key
+    Tox_ID_to_public_key = True
+    ):
+    """
+    Return a boolean indicating whether a contact is online.
+    """
+    if Tox_ID_to_public_key:
+        contact = contact[:64]
+    return contact_registry.online(contact = contact)
+
+def set_retention(
+    maximum_count         = None,  # maximum number of messages
+    maximum_count_contact = 10000, # maximum number of messages per contact
+    maximum_age           = None   # s, maximum age of messages
+    ):
+    """
+    Set the limits beyond which the oldest messages received are discarded.
+    """
+    message_store.set_retention(
+        maximum_count         = maximum_count,
+        maximum_count_contact = maximum_count_contact,
+        maximum_age           = maximum_age
+    )
+
+def open_read_state(
+    filepath = None
+    ):
+    """
+    Open the store of read state at the specified path or, by default, at the
+    path read_state_filepath. If the path is None, read state is not saved.
+    """
+    global read_state_store
+    filepath = filepath or read_state_filepath
+    if read_state_store is None and filepath:
+        try:
+            read_state_store = ReadStateStore(filepath = filepath)
+            atexit.register(save_read_state)
+        except Exception as error:
+            log.error("error -- read state {filepath} not opened: {error}".format(
+                filepath = filepath,
+                error    = error
+            ))
+    return read_state_store
+
+def save_read_state(
+    interval = None # s, minimum time since previous save
+    ):
+    """
+    Save the read state of all contacts whose messages have been read.
+    """
+    global read_state_time
+    if read_state_store is None:
+        return
+    if interval and time.time() - read_state_time < interval:
+        return
+    read_state_time = time.time()
+    states = {}
+    for contact, tail in list(text_out_tails.items()):
+        if tail.inode() is None:
+            continue
+        offset, seen = message_store.cursor(
+            contact     = contact,
+            offset_read = tail.offset()
+        )
+        states[contact] = (tail.inode(), offset, seen)
+    try:
+        read_state_store.save(states = states)
+    except Exception as error:
+        log.error("error -- read state not saved: {error}".format(error = error))
+
+def load_history():
+    """
+    Get existing messages. For contacts with saved read state, reading resumes
+    from the saved offset and messages not seen previously are unseen. For other
+    contacts, all existing messages are set to seen.
+    """
+    global text_out_tails
+    states = {}
+    if open_read_state() is not None:
+        states = read_state_store.load()
+    for contact in all_contacts():
+        tail = TextOutTail(
+            filepath = "{contact}/text_out".format(contact = contact)
+        )
+        text_out_tails[contact] = tail
+        state = states.get(contact)
+        resumed = state is not None and tail.resume(
+            inode  = state["inode"],
+            offset = state["offset"]
+        )
+        for offset, line in tail.read_lines_offsets():
+            message_store.add(
+                Message(
+                    raw_string = line,
+                    contact    = contact,
+                    seen       = not resumed or offset in state["seen"],
+                    offset     = offset
+                )
+            )
+
+def get_messages():
+    global message_store
+    global text_out_tails
+    global history_loaded
+    if not history_loaded:
+        history_loaded = True
+        load_history()
+    contacts = all_contacts()
+    # append any new messages to store of messages received, reading only the
+    # data appended to each contact's text_out since the previous read
+    for contact in contacts:
+        if contact not in text_out_tails:
+            text_out_tails[contact] = TextOutTail(
+                filepath = "{contact}/text_out".format(contact = contact)
+            )
+        for offset, line in text_out_tails[contact].read_lines_offsets():
+            message_store.add(
+                Message(
+                    raw_string = line,
+                    contact    = contact,
+                    offset     = offset
+                )
+            )
+    save_read_state(interval = 1)
+
+def received_messages(
+    contact              = None, # Tox ID or public key
+    contacts             = None, # list of Tox IDs or public keys
+    unseen               = None, # unseen messages only
+    Tox_ID_to_public_key = True
+    ):
+    global message_store
+    get_messages()
+    if contact:
+        contacts = [contact]
+    if contacts == "all":
+        contacts = None
+    if contacts and Tox_ID_to_public_key:
+        contacts = [contact[:64] for contact in contacts]
+    return message_store.messages(
+        contacts = contacts or None,
+        unseen   = bool(unseen)
+    )
 
-def remove(
+def consumer(
+    name  = None,
+    start = "latest" # "latest" or "earliest" message, for a new consumer
+    ):
+    """
+    Return the consumer of the specified name, creating it if it does not exist.
+    Each consumer reads received messages independently with its own read
+    position for each contact.
+    """
+    global consumers
+    if name not in consumers:
+        # read existing messages first, so that they precede a latest start
+        get_messages()
+        consumers[name] = Consumer(
+            name  = name,
+            store = message_store,
+            start = start
+        )
+    return consumers[name]
+
+def consume_messages(
+    name                 = None,
     contact              = None, # Tox ID or public key
     contacts             = None, # list of Tox IDs or public keys
     Tox_ID_to_public_key = True
     ):
+    """
+    Return a list of the messages received not yet read by the named consumer,
+    optionally from specified contacts only, advancing its read positions.
+    """
+    get_messages()
     if contact:
         contacts = [contact]
     if contacts == "all":
-        contacts = all_contacts()
-    if contacts:
-        if Tox_ID_to_public_key:
-            contacts = [contact[:64] for contact in contacts]
-        for contact in contacts:
-            command = "echo 1 > {contact}/remove".format(
-                contact = contact
-            )
-            try:
-                engage_command(command = command)
-            except:
-                pass
+        contacts = None
+    if contacts and Tox_ID_to_public_key:
+        contacts = [contact[:64] for contact in contacts]
+    return consumer(name = name).messages(contacts = contacts or None)
 
-def send_message(
+def last_received_message(
     contact              = None, # Tox ID or public key
     contacts             = None, # list of Tox IDs or public keys
-    text                 = None, # text to send
-    filepath             = None, # file to send
+    unseen               = True, # unseen messages only
     Tox_ID_to_public_key = True
     ):
+    global message_store
+    get_messages()
     if contact:
         contacts = [contact]
     if contacts == "all":
-        contacts = all_contacts()
-    if contacts:
-        if Tox_ID_to_public_key:
-            contacts = [contact[:64] for contact in contacts]
-        for contact in contacts:
-            if os.path.exists(contact):
-                if text:
-                    command = "echo \"{text}\" > {contact}/text_in".format(
-                        text    = text,
-                        contact = contact
-                    )
-                    try:
-                        engage_command(command = command)
-                    except:
-                        pass
-                if filepath:
-                    if os.path.exists(filepath):
-                        command =\
-                            "cat \"{filepath}\" > {contact}/file_in".format(
-                            filepath = filepath,
-                            contact  = contact
-                        )
-                        try:
-                            engage_command(command = command)
-                        except:
-                            pass
-                    else:
-                        log.error("error -- {filepath} not found".format(
-                            filepath = filepath
-                        ))
-    if not contacts:
-        log.error("error -- no contacts specified")
-
-def send_request_and_message(
-    contact  = None, # Tox ID or public key
-    contacts = None, # list of Tox IDs or public keys
-    text     = None, # text to send
-    filepath = None  # file to send
-    ):
-    send_request(
-        contact  = contact,
-        contacts = contacts
-    )
-    send_message(
-        contact  = contact,
-        contacts = contacts,
-        text     = text,
-        filepath = filepath
-    )
-
-def send_self_ID(
-    contact  = None, # Tox ID or public key
-    contacts = None  # list of Tox IDs or public keys
-    ):
-    send_message(
-        contact  = contact,
-        contacts = contacts,
-        text     = self_ID()
+        contacts = None
+    if contacts and Tox_ID_to_public_key:
+        contacts = [contact[:64] for contact in contacts]
+    return message_store.last_message(
+        contacts = contacts or None,
+        unseen   = bool(unseen)
     )
 
-def all_contacts():
+def get_watcher():
     """
-    Return a list of contacts by collating all directories at the working
-    directory that are not ratox directories and contain a file `status`.
+    Return the watcher of the ratox working directory, starting it if it is not
+    running.
     """
-    return [
-        directory for directory in next(os.walk("."))[1]\
-        if directory not in [
-            "conf",
-            "name",
-            "nospam",
-            "request",
-            "state",
-            "status"
-        ] and\
-        os.path.isfile(directory + "/status")
-    ]
-
-def get_messages():
-    global messages_received
-    contacts = all_contacts()
-    # append any new messages to store of messages received
-    for contact in contacts:
-        # old messages
-        messages_old = [
-            message._raw_string for message in messages_received\
-            if message.contact() == contact
-        ]
-        # old and possibly new messages
-        messages_new = [
-            line.rstrip("\n") for line in open("{contact}/text_out".format(
-                contact = contact
-            ))
-        ]
-        # if new messages are different to old messages, remove old messages
-        # from new messages and add to store of messages
-        if messages_new != messages_old:
-            messages_to_store = messages_new[len(messages_old):]
-            for message in messages_to_store:
-                    messages_received.append(
-                        Message(
-                            raw_string = message,
-                            contact    = contact
-                        )
-                    )
+    global event_watcher
+    if event_watcher is None:
+        event_watcher = Watcher()
+        event_watcher.start()
+        contact_registry.attach(watcher = event_watcher)
+    return event_watcher
 
-def received_messages(
-    contact  = None, # Tox ID or public key
-    contacts = None, # list of Tox IDs or public keys
-    unseen   = None  # unseen messages only
+def wait_for_event(
+    generation = None,
+    timeout    = None  # s
     ):
-    global messages_received
-    get_messages()
-    if contact:
-        contacts = [contact]
-    if contacts == "all":
-        contacts = all_contacts()
-    if contacts:
-        messages = [
-            message for message in messages_received\
-            if message.contact(preserve_visibility = True) in contacts
-        ]
-    if unseen:
-        messages = [
-            message for message in messages_received\
-            if not message.seen()
-        ]
-    else:
-        messages = [
-            message for message in messages_received
-        ]
-    return messages
+    """
+    Wait until a change is detected at the ratox working directory, such as a
+    message being received, a call state changing or a request arriving. Return
+    the watcher generation reached.
+    """
+    return get_watcher().wait(generation = generation, timeout = timeout)
 
-def last_received_message(
+def wait_for_message(
     contact  = None, # Tox ID or public key
     contacts = None, # list of Tox IDs or public keys
-    unseen   = True  # unseen messages only
+    unseen   = True, # unseen messages only
+    timeout  = None  # s
     ):
-    messages = received_messages(
-        contact  = contact,
-        contacts = contacts,
-        unseen   = unseen
-    )
-    if messages:
-        return messages[-1]
-    else:
-        return None
+    """
+    Wait for a message from the specified contact or contacts and return it, or
+    return None if no message is received before the timeout.
+    """
+    watcher = get_watcher()
+    if timeout is not None:
+        time_stop = time.time() + timeout
+    while True:
+        generation = watcher.generation()
+        message = last_received_message(
+            contact  = contact,
+            contacts = contacts,
+            unseen   = unseen
+        )
+        if message is not None:
+            return message
+        if timeout is None:
+            time_wait = 1
+        else:
+            time_wait = min(1, time_stop - time.time())
+            if time_wait <= 0:
+                return None
+        # wake on change; the timeout guards against missed notifications
+        watcher.wait(generation = generation, timeout = time_wait)
 
 def send_heartbeat(
     contact  = None, # Tox ID or public key
@@ -516,6 +4086,7 @@ def send_heartbeat(
     text     = None
     ):
     if not text:
+        import megaparsex
         text = megaparsex.heartbeat_message()
     text = text + "\n\nTox ID: " + self_ID()
     try:
@@ -544,17 +4115,19 @@ def contact_calling(
     if contact:
         if Tox_ID_to_public_key:
             contact = contact[:64]
-        try:
-            return "pending" in [line.rstrip("\n") for line in open(contact + "/call_state")][0]
-        except:
+        call_state = contact_registry.read(contact = contact, filename = "call_state")
+        if call_state is None:
             log.error("error -- invalid contact specified?")
+            return False
+        return "pending" in call_state
     else:
         log.error("error -- no contact specified")
         return False
 
 def get_contacts_calling():
     """
-    Return a list of contacts with pending calls.
+    Return a list of contacts with pending calls. Call states are read through
+    the contact registry, so that unchanged call_state files are not reread.
     """
     contacts_calling = []
     for contact in all_contacts():
@@ -562,17 +4135,68 @@ def get_contacts_calling():
             contacts_calling.append(contact)
     return contacts_calling
 
+def handle_calls(
+    handler = None, # function called with the public key of a calling contact
+    workers = 4     # maximum number of concurrent calls
+    ):
+    """
+    Handle incoming calls concurrently, each with the handler specified in a
+    worker of its own, and return the call manager. By default, each call is
+    recorded to a WAVE file named by contact and time. Calls are handled until
+    stop_handling_calls is called.
+    """
+    global call_manager
+    if not capable("calls"):
+        return None
+    if handler is None:
+        def handler(contact):
+            return receive_call(
+                contact  = contact,
+                filepath = "call_{contact}_{time}.wav".format(
+                    contact = contact,
+                    time    = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H%M%SZ")
+                )
+            )
+    stop_handling_calls()
+    call_manager = CallManager(
+        handler = handler,
+        workers = workers,
+        watcher = get_watcher()
+    )
+    call_manager.start()
+    return call_manager
+
+def stop_handling_calls(
+    wait = True # wait for calls being handled to finish
+    ):
+    global call_manager
+    if call_manager is not None:
+        call_manager.stop(wait = wait)
+        call_manager = None
+
 def receive_call(
-    contact              = None, # Tox ID or public key
+    contact              = None,  # Tox ID or public key
     Tox_ID_to_public_key = True,
-    filepath             = None, # sound recording file
-    sample_rate          = 48000
+    filepath             = None,  # sound recording file
+    sample_rate          = 48000,
+    speaker              = None,  # play to speakers, by default if no file or callback
+    callback             = None,  # function called with each chunk of PCM
+    silence_threshold    = 0.05,  # RMS, fraction of full scale
+    silence_duration     = 10,    # s, of silence after which to stop, None for never
+    timeout              = None,  # s, maximum wait for call data
+    background           = False  # return while the call is being received
     ):
     """
     Answer a call from a specified contact or from the first contact found to be
-    calling. Call data is sent to aplay (speakers) or file as specified. Call
-    data receiving for file is stopped on detection of 10 s of 5 % silence.
+    calling and return its call session. Call data is received in process and
+    sent to speakers, a WAVE file and a callback as specified, with silence
+    trimmed from the file and callback. Call data receiving is stopped on
+    detection of silence of the duration and threshold specified or when the
+    contact hangs up. If NumPy is unavailable, call data is sent to aplay
+    (speakers) or rec (file).
     """
+    if not capable("calls"):
+        return False
     if contact:
         if Tox_ID_to_public_key:
             contact = contact[:64]
@@ -588,10 +4212,48 @@ def receive_call(
         else:
             log.error("error -- no contacts identified as calling")
             return False
-    if filepath:
-        command = "rec -q -r {sample_rate} -c 1 {filepath} silence 0 1 0:00:10 5% < {contact}/call_out".format(
+    if speaker is None:
+        speaker = not filepath and not callback
+    if speaker and not capable("speaker"):
+        return False
+    call = Call(contact = contact, direction = "incoming")
+    try:
+        call._receiver = CallReceiver(
+            contact           = contact,
+            sample_rate       = sample_rate,
+            filepath          = filepath,
+            speaker           = speaker,
+            callback          = callback,
+            silence_threshold = silence_threshold,
+            silence_duration  = silence_duration,
+            timeout           = timeout,
+            call              = call
+        )
+    except ImportError:
+        pass
+    if call._receiver:
+        return call._run(
+            function   = call._receiver.receive,
+            watcher    = get_watcher(),
+            background = background
+        )
+    if callback:
+        log.error("error -- NumPy required for call data callback")
+        return False
+    if filepath and not capable("recording"):
+        return False
+    if filepath and silence_duration is None:
+        command = "rec -q -r {sample_rate} -c 1 {filepath} < {contact}/call_out".format(
+            sample_rate = sample_rate,
+            filepath    = filepath,
+            contact     = contact
+        )
+    elif filepath:
+        command = "rec -q -r {sample_rate} -c 1 {filepath} silence 0 1 {duration} {threshold}% < {contact}/call_out".format(
             sample_rate = sample_rate,
             filepath    = filepath,
+            duration    = silence_duration,
+            threshold   = 100 * silence_threshold,
             contact     = contact
         )
     else:
@@ -599,62 +4261,248 @@ def receive_call(
             sample_rate = sample_rate,
             contact     = contact
         )
-    engage_command(command = command, background = False)
-    return True
+    def receive():
+        engage_command(command = command, background = False)
+        return True
+    return call._run(
+        function   = receive,
+        watcher    = get_watcher(),
+        background = background
+    )
 
 def send_call(
     contact              = None,  # Tox ID or public key
     Tox_ID_to_public_key = True,
     filepath             = None,
+    filepath_PCM         = None,  # mono 16-bit PCM at sample rate
     record               = False,
-    duration_record      = None,  # arecord (microphone) duration (s)
-    sample_rate          = 48000
+    duration_record      = None,  # microphone duration (s)
+    stream               = None,  # microphone stream, by default a new stream
+    sample_rate          = 48000,
+    timeout              = 30,    # s, maximum wait for call data to be read
+    background           = False  # return while the call is being sent
     ):
     """
-    Send a call to a specified contact. Sound is sent from sound file or arecord
-    (microphone) as specified.
+    Send a call to a specified contact and return its call session. Sound is
+    sent from sound file, raw PCM file or microphone as specified and is
+    streamed in real time to the call in process. A PCM WAVE file is converted
+    to mono 16-bit PCM at the sample rate in process and other sound files are
+    converted by ffmpeg. The microphone is captured once and shared by
+    concurrent calls, each call reading a stream of its own. Streaming stops
+    when the contact hangs up or the call is cancelled.
     """
+    if not capable("calls"):
+        return False
     if contact:
         if Tox_ID_to_public_key:
             contact = contact[:64]
-        if contact_calling(contact = contact):
-            command = command_base.format(contact = contact)
     else:
         log.error("error -- no contact specified")
         return False
-    if filepath:
+    filepath_FIFO = "{contact}/call_in".format(contact = contact)
+    # chunks of 0.1 s
+    chunk_size = 2 * sample_rate // 10
+    call = Call(contact = contact, direction = "outgoing")
+    if filepath_PCM:
+        def send():
+            with open(filepath_PCM, "rb") as file_PCM:
+                return write_FIFO(
+                    filepath = filepath_FIFO,
+                    data     = call._chunks(iter(lambda: file_PCM.read(chunk_size), b"")),
+                    timeout  = timeout,
+                    rate     = 2 * sample_rate
+                )
+    elif filepath:
         filepath = os.path.expanduser(filepath)
         if not os.path.exists(filepath):
             log.error("error -- {filepath} not found".format(filepath = filepath))
             return False
-        duration = duration_WAVE_file(filepath) + 3
-        command = "ffmpeg -loglevel panic -i {filepath} -ar {sample_rate} -f s16le -acodec pcm_s16le pipe:1 > {contact}/call_in &".format(
-            filepath    = filepath,
-            sample_rate = sample_rate,
-            contact     = contact
-        )
-        engage_command(command = command, background = False, timeout = duration)
-        return True
-    elif record:
-        if duration_record:
-            command = "arecord -r {sample_rate} -c 1 -f S16_LE -duration={duration_record} > {contact}/call_in".format(
-                sample_rate     = sample_rate,
-                duration_record = duration_record,
-                contact         = contact
+        try:
+            chunks = WAVE_PCM_chunks(filepath = filepath, sample_rate = sample_rate)
+        except (ImportError, EOFError, wave.Error) as error:
+            # not a PCM WAVE file or NumPy unavailable
+            log.debug("stream with ffmpeg: {error}".format(error = error))
+            chunks = None
+        if chunks is None and not capable("conversion"):
+            return False
+        def send():
+            if chunks is not None:
+                return write_FIFO(
+                    filepath = filepath_FIFO,
+                    data     = call._chunks(chunks),
+                    timeout  = timeout,
+                    rate     = 2 * sample_rate
+                )
+            process = subprocess.Popen(
+                [
+                    "ffmpeg", "-loglevel", "panic", "-i", filepath,
+                    "-ar", str(sample_rate), "-ac", "1", "-f", "s16le",
+                    "-acodec", "pcm_s16le", "pipe:1"
+                ],
+                stdout = subprocess.PIPE
             )
-        else:
-            command = "arecord -r {sample_rate} -c 1 -f S16_LE > {contact}/call_in".format(
-                sample_rate = sample_rate,
-                contact     = contact
+            try:
+                return write_FIFO(
+                    filepath = filepath_FIFO,
+                    data     = call._chunks(
+                        iter(lambda: process.stdout.read(chunk_size), b"")
+                    ),
+                    timeout  = timeout,
+                    rate     = 2 * sample_rate
+                )
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                process.stdout.close()
+                process.wait()
+    elif record:
+        if stream is None and not capable("microphone"):
+            return False
+        if stream is None:
+            stream = get_microphone(sample_rate = sample_rate).stream(
+                duration = duration_record
             )
-        #engage_command(command = command, background = False, timeout = duration_record + 1)
-        engage_command(command = command, background = True)
-        time.sleep(duration_record)
-        engage_command(command = "killall arecord")
-        return True
+        call._stream = stream
+        def send():
+            try:
+                return write_FIFO(
+                    filepath = filepath_FIFO,
+                    data     = call._chunks(iter(stream)),
+                    timeout  = timeout
+                )
+            finally:
+                stream.close()
     else:
         log.error("error -- neither sound file nor recording specified for sending call")
         return False
+    return call._run(
+        function   = send,
+        watcher    = get_watcher(),
+        background = background
+    )
+
+def get_microphone(
+    sample_rate = 48000
+    ):
+    """
+    Return the shared microphone capture, creating it if it does not exist or
+    if its sample rate differs.
+    """
+    global microphone
+    if microphone is None or microphone._sample_rate != sample_rate:
+        microphone = Microphone(sample_rate = sample_rate)
+    return microphone
+
+def send_calls_microphone(
+    contacts             = "all", # list of Tox IDs or public keys
+    Tox_ID_to_public_key = True,
+    duration_record      = None,  # microphone duration (s)
+    sample_rate          = 48000,
+    timeout              = 30,    # s, maximum wait for a call to be answered
+    workers              = 16     # maximum number of concurrent calls
+    ):
+    """
+    Send calls of the microphone to contacts concurrently, so that a voice
+    message reaches all contacts at the same time. The microphone is captured
+    once for all of the calls. Return a dictionary of the call session for each
+    contact, or False for a contact which could not be called. A call session is
+    true if its sound was written to ratox and indicates whether the call was
+    answered with answered.
+    """
+    if not capable("calls") or not capable("microphone"):
+        return {}
+    if contacts == "all":
+        contacts = all_contacts()
+    if not contacts:
+        log.error("error -- no contacts specified")
+        return {}
+    if Tox_ID_to_public_key:
+        contacts = [contact[:64] for contact in contacts]
+    capture = get_microphone(sample_rate = sample_rate)
+    streams = dict(
+        (contact, capture.stream(duration = duration_record))\
+        for contact in contacts
+    )
+    def send(contact = None):
+        return send_call(
+            contact     = contact,
+            record      = True,
+            stream      = streams[contact],
+            sample_rate = sample_rate,
+            timeout     = timeout
+        )
+    try:
+        return run_for_contacts(
+            function = send,
+            contacts = contacts,
+            workers  = workers
+        )
+    finally:
+        for stream in streams.values():
+            stream.close()
+
+def get_speech_cache():
+    """
+    Return the cache of synthesized speech, creating it if it does not exist.
+    """
+    global speech_cache
+    if speech_cache is None:
+        speech_cache = SpeechCache()
+    return speech_cache
+
+def get_speech_engine(
+    workers = 1 # maximum number of concurrent syntheses
+    ):
+    """
+    Return the persistent festival speech engine, creating it if it does not
+    exist.
+    """
+    global speech_engine
+    if speech_engine is None:
+        speech_engine = SpeechEngine(workers = workers)
+        atexit.register(speech_engine.stop)
+    return speech_engine
+
+def synthesize_speech(
+    text               = None,
+    preference_program = "festival"
+    ):
+    """
+    Synthesize speech to a temporary WAVE file and return its path. Festival
+    speech is synthesized by the persistent speech engine, falling back to
+    propyte, which launches the speech program for each synthesis.
+    """
+    if preference_program == "festival" and which("festival"):
+        try:
+            return get_speech_engine().synthesize(text = text).result()
+        except Exception:
+            log.warning("warning -- speech engine failed -- launch speech program")
+    import propyte
+    filepath_tmp = propyte.say_tmp_filepath(
+        text               = text,
+        preference_program = preference_program
+    )
+    log.debug("save synthesized speech to " + filepath_tmp)
+    return filepath_tmp
+
+def warm_speech_cache(
+    texts              = None,        # list of texts
+    preference_program = "festival",
+    sample_rate        = 48000
+    ):
+    """
+    Synthesize speech for texts into the cache of synthesized speech, so that
+    calls using them do not wait for synthesis.
+    """
+    if not capable("speech"):
+        return False
+    for text in texts:
+        get_speech_cache().synthesize(
+            text               = text,
+            preference_program = preference_program,
+            sample_rate        = sample_rate
+        )
+    return True
 
 def send_call_synthesized_speech(
     contact              = None,                # Tox ID or public key
@@ -663,36 +4511,100 @@ def send_call_synthesized_speech(
     sample_rate          = 48000,
     preference_program   = "festival"
     ):
-    filepath_tmp = propyte.say_tmp_filepath(
+    """
+    Send a call of synthesized speech to a contact. Speech is synthesized once
+    per text, speech program and sample rate and is then streamed from the
+    cache of synthesized speech.
+    """
+    if Tox_ID_to_public_key:
+        contact = contact[:64]
+    results = send_calls_synthesized_speech(
+        contacts           = [contact],
+        text               = text,
+        sample_rate        = sample_rate,
+        preference_program = preference_program
+    )
+    return results.get(contact, False)
+
+def send_calls_synthesized_speech(
+    contacts             = "all",               # list of Tox IDs or public keys
+    text                 = "This is an alert.",
+    Tox_ID_to_public_key = True,
+    sample_rate          = 48000,
+    preference_program   = "festival",
+    workers              = 8                    # maximum number of concurrent calls
+    ):
+    """
+    Send calls of synthesized speech to contacts concurrently. Speech is
+    synthesized once and the same sound is streamed to every call. Return a
+    dictionary of the call session for each contact, or False for a contact
+    which could not be called. A call session is true if its sound was written
+    to ratox and indicates whether the call was answered with answered.
+    """
+    if not capable("speech") or not capable("calls"):
+        return {}
+    if contacts == "all":
+        contacts = all_contacts()
+    if not contacts:
+        log.error("error -- no contacts specified")
+        return {}
+    if Tox_ID_to_public_key:
+        contacts = [contact[:64] for contact in contacts]
+    try:
+        filepath_PCM = get_speech_cache().synthesize(
+            text               = text,
+            preference_program = preference_program,
+            sample_rate        = sample_rate
+        )
+    except ImportError:
+        filepath_PCM = None
+    if filepath_PCM:
+        return run_for_contacts(
+            function     = send_call,
+            contacts     = contacts,
+            workers      = workers,
+            filepath_PCM = filepath_PCM,
+            sample_rate  = sample_rate
+        )
+    # NumPy unavailable
+    filepath_tmp = synthesize_speech(
         text               = text,
         preference_program = preference_program
     )
-    log.debug("save synthesized speech to " + filepath_tmp)
     append_silence_to_WAVE_file(filepath = filepath_tmp, duration = 3000)
-    send_call(
-        contact     = contact,
+    results = run_for_contacts(
+        function    = send_call,
+        contacts    = contacts,
+        workers     = workers,
         filepath    = filepath_tmp,
         sample_rate = sample_rate
     )
-    #os.remove(filepath_tmp)
+    os.remove(filepath_tmp)
+    return results
 
 def get_input(
     contact  = None,
     contacts = None,
-    prompt   = "input: "
+    prompt   = "input: ",
+    timeout  = None  # s
     ):
+    """
+    Send a prompt and return the text of the response, or return None if there
+    is no response before the timeout.
+    """
     send_message(
         contact  = contact,
         contacts = contacts,
         text     = prompt
     )
-    response = None
-    while response is None:
-        response = last_received_message(
-            contact  = contact,  # Tox ID or public key
-            contacts = contacts, # list of Tox IDs or public keys
-            unseen   = True      # unseen messages only
-        )
+    response = wait_for_message(
+        contact  = contact,  # Tox ID or public key
+        contacts = contacts, # list of Tox IDs or public keys
+        unseen   = True,     # unseen messages only
+        timeout  = timeout
+    )
+    if response is None:
+        return None
     return response.text()
 
 def run_command(
@@ -708,10 +4620,7 @@ def run_command(
     """
     if command is None:
         send_message(contact = contact, text = "enter command to run")
-        message = None
-        while message is None:
-            message = last_received_message(contact = contact, unseen = False)
-            time.sleep(0.3)
+        message = wait_for_message(contact = contact, unseen = True)
         command = message.text()
     send_message(
         contact = contact,
@@ -727,7 +4636,8 @@ def run_command(
         output = engage_command(command = command)
         send_message(
             contact = contact,
-            text    = "output:\n\n{output}".format(output = output)
+            text    = "output:\n\n{output}".format(output = output),
+            markers = True
         )
     else:
         log.info("abort command run")
@@ -765,23 +4675,134 @@ def engage_command(
     else:
         return None
 
+def process_running(
+    pid     = None,
+    program = None
+    ):
+    """
+    Return a boolean indicating whether a process exists, is not a zombie and,
+    if a program is specified, is running that program.
+    """
+    try:
+        with open("/proc/{pid}/stat".format(pid = pid)) as file_stat:
+            fields = file_stat.read()
+    except (IOError, OSError):
+        return False
+    # /proc/<pid>/stat: pid (comm) state ...
+    comm  = fields[fields.find("(") + 1:fields.rfind(")")]
+    state = fields[fields.rfind(")") + 2:][:1]
+    if state == "Z":
+        return False
+    return program is None or comm == program[:15]
+
 def running(
     program
     ):
+    """
+    Return a boolean indicating whether a program is running. For ratox, the
+    instance launched by start_messaging is checked first without system-wide
+    scanning. Otherwise, processes are matched by exact program name from
+    `/proc`, or from `ps` if `/proc` is unavailable.
+    """
+    if program == "ratox" and ratox_process.running():
+        return True
+    if os.path.isdir("/proc"):
+        return any(
+            process_running(pid = pid, program = program)\
+            for pid in os.listdir("/proc") if pid.isdigit()
+        )
     results = subprocess.Popen(
-        ["ps", "-A"],
+        ["ps", "-A", "-o", "comm=,stat="],
         stdout             = subprocess.PIPE,
         universal_newlines = True
     ).communicate()[0].split("\n")
-    results = results
     matches_current = [
-        line for line in results if program in line and "defunct" not in line
+        line for line in results\
+        if line.split() and line.split()[0] == program and "Z" not in line.split()[-1]
     ]
     if matches_current:
         return True
     else:
         return False
 
+def WAVE_PCM_chunks(
+    filepath       = None,
+    sample_rate    = 48000,
+    chunk_duration = 0.1    # s
+    ):
+    """
+    Return an iterator of chunks of the sound of a PCM WAVE file converted to
+    mono signed 16-bit little-endian PCM at the specified sample rate. Channels
+    are averaged and the sound is resampled by linear interpolation chunk by
+    chunk, so that memory use does not depend on file size. Raise ImportError if
+    NumPy is unavailable and wave.Error if the file is not a PCM WAVE file.
+    """
+    import numpy
+    file_WAVE = wave.open(filepath, "rb")
+    if file_WAVE.getcomptype() != "NONE":
+        file_WAVE.close()
+        raise wave.Error("compressed WAVE file")
+    return _WAVE_PCM_chunks(
+        numpy          = numpy,
+        file_WAVE      = file_WAVE,
+        sample_rate    = sample_rate,
+        chunk_duration = chunk_duration
+    )
+
+def _WAVE_PCM_chunks(
+    numpy          = None,
+    file_WAVE      = None,
+    sample_rate    = 48000,
+    chunk_duration = 0.1
+    ):
+    channels     = file_WAVE.getnchannels()
+    sample_width = file_WAVE.getsampwidth()
+    frame_rate   = file_WAVE.getframerate()
+    frames_chunk = max(1, int(frame_rate * chunk_duration))
+    step         = float(frame_rate) / sample_rate
+    position     = 0.0  # of next output sample in input buffer
+    previous     = None # last input sample of previous chunk
+    try:
+        while True:
+            data = file_WAVE.readframes(frames_chunk)
+            data = data[:len(data) - len(data) % (channels * sample_width)]
+            if not data:
+                break
+            if sample_width == 1:
+                samples = (numpy.frombuffer(data, numpy.uint8) - 128.0) / 128
+            elif sample_width == 2:
+                samples = numpy.frombuffer(data, "<i2") / 32768.0
+            elif sample_width == 3:
+                bytes_ = numpy.frombuffer(data, numpy.uint8).reshape(-1, 3)
+                samples = bytes_[:, 0].astype(numpy.int32) |\
+                          bytes_[:, 1].astype(numpy.int32) << 8 |\
+                          bytes_[:, 2].astype(numpy.int32) << 16
+                samples = ((samples ^ 0x800000) - 0x800000) / 8388608.0
+            elif sample_width == 4:
+                samples = numpy.frombuffer(data, "<i4") / 2147483648.0
+            else:
+                raise wave.Error("unsupported sample width")
+            samples = samples.reshape(-1, channels).mean(axis = 1)
+            if frame_rate != sample_rate:
+                if previous is not None:
+                    samples = numpy.concatenate(([previous], samples))
+                previous = samples[-1]
+                positions = numpy.arange(position, len(samples) - 1, step)
+                if len(samples) == 1 or not len(positions):
+                    position -= len(samples) - 1
+                    continue
+                samples_out = numpy.interp(
+                    positions,
+                    numpy.arange(len(samples)),
+                    samples
+                )
+                position = positions[-1] + step - (len(samples) - 1)
+                samples = samples_out
+            samples = numpy.clip(numpy.round(samples * 32768), -32768, 32767)
+            yield samples.astype("<i2").tobytes()
+    finally:
+        file_WAVE.close()
+
 def duration_WAVE_file(
     filepath = None
     ):
@@ -803,21 +4824,98 @@ def append_silence_to_WAVE_file(
     duration = 3000  # ms
     ):
     """
-    Append a specified duration of silence to a WAVE file in place.
+    Append a specified duration of silence to a PCM WAVE file in place. Silent
+    frames are written after the data chunk and the RIFF and data chunk sizes
+    are updated, so that the existing sound is neither read nor rewritten. If
+    the data chunk is followed by other chunks, the file is instead copied in
+    chunks with the silence appended.
     """
     if filepath:
         filepath = os.path.expanduser(filepath)
         if not os.path.exists(filepath):
             log.error("error -- {filepath} not found".format(filepath = filepath))
             return False
-        sound = AudioSegment.from_wav(filepath) + AudioSegment.silent(duration = duration)
-        sound.export(filepath, format = "wav")
+        try:
+            with open(filepath, "r+b") as file_WAVE:
+                header = file_WAVE.read(12)
+                if len(header) < 12 or header[:4] != b"RIFF" or header[8:] != b"WAVE":
+                    raise wave.Error("not a RIFF WAVE file")
+                file_size = os.fstat(file_WAVE.fileno()).st_size
+                fmt  = None
+                data = None
+                while data is None and file_WAVE.tell() + 8 <= file_size:
+                    chunk_ID, chunk_size = struct.unpack("<4sI", file_WAVE.read(8))
+                    if chunk_ID == b"fmt ":
+                        fmt = struct.unpack("<HHIIHH", file_WAVE.read(16))
+                        file_WAVE.seek(chunk_size - 16 + (chunk_size & 1), 1)
+                    elif chunk_ID == b"data":
+                        data = (file_WAVE.tell(), chunk_size)
+                    else:
+                        file_WAVE.seek(chunk_size + (chunk_size & 1), 1)
+                if fmt is None or data is None or fmt[0] != 1:
+                    raise wave.Error("not a PCM WAVE file")
+                format_tag, channels, frame_rate, byte_rate, block_align, bits = fmt
+                data_start, data_size = data
+                size = int(round(frame_rate * duration / 1000.0)) * block_align
+                # silence is the midpoint: 128 for unsigned 8-bit, 0 otherwise
+                fill = b"\x80" if bits == 8 else b"\x00"
+                if data_start + data_size + (data_size & 1) < file_size:
+                    file_WAVE.close()
+                    return _append_silence_to_WAVE_file_copy(
+                        filepath = filepath,
+                        size     = size,
+                        fill     = fill
+                    )
+                file_WAVE.seek(data_start + data_size)
+                remaining = size
+                while remaining:
+                    block = min(remaining, 65536)
+                    file_WAVE.write(fill * block)
+                    remaining -= block
+                data_size += size
+                if data_size & 1:
+                    file_WAVE.write(b"\x00")
+                file_WAVE.truncate()
+                file_WAVE.seek(data_start - 4)
+                file_WAVE.write(struct.pack("<I", data_size))
+                file_WAVE.seek(4)
+                file_WAVE.write(struct.pack(
+                    "<I",
+                    data_start + data_size + (data_size & 1) - 8
+                ))
+        except (IOError, OSError, struct.error, wave.Error) as error:
+            log.error("error -- silence not appended to {filepath}: {error}".format(
+                filepath = filepath,
+                error    = error
+            ))
+            return False
         return True
     else:
         log.error("error -- wave file filepath not specified")
         return False
 
-# get existing messages and set them to seen
-get_messages()
-for message in messages_received:
-    message.set_seen()
+def _append_silence_to_WAVE_file_copy(
+    filepath = None,
+    size     = 0,     # bytes of silence
+    fill     = b"\x00"
+    ):
+    filepath_tmp = filepath + ".tmp"
+    file_in  = wave.open(filepath, "rb")
+    file_out = wave.open(filepath_tmp, "wb")
+    try:
+        file_out.setparams(file_in.getparams())
+        while True:
+            frames = file_in.readframes(65536)
+            if not frames:
+                break
+            file_out.writeframes(frames)
+        remaining = size
+        while remaining:
+            block = min(remaining, 65536)
+            file_out.writeframesraw(fill * block)
+            remaining -= block
+    finally:
+        file_in.close()
+        file_out.close()
+    os.rename(filepath_tmp, filepath)
+    return True
@@ -43,11 +43,11 @@ options:
 
     --contacts=ID  comma-delimited approved contacts  [default: all]
     --text=TEXT    text to send                       [default: alert]
+    --ttl=INT      maximum wait for contacts (s)      [default: 600]
 """
 
 import docopt
 import socket
-import time
 
 import dendrotox
 
@@ -56,13 +56,29 @@ version = "2018-03-02T0004Z"
 
 def main(options):
 
-    dendrotox.start_messaging(pause_time = 60)
-    dendrotox.set_name(text = name + "@" + socket.gethostname())
     contacts = options["--contacts"]
     if contacts != "all": contacts = options["--contacts"].split(",")
     text = options["--text"]
-    dendrotox.send_request_and_message(contacts = contacts, text = text)
-    time.sleep(30)
+    ttl  = int(options["--ttl"])
+    dendrotox.start_messaging()
+    dendrotox.set_name(text = name + "@" + socket.gethostname())
+    if contacts == "all": contacts = dendrotox.all_contacts()
+    for contact in contacts:
+        if len(contact) == 76:
+            dendrotox.send_request(contact = contact)
+    # sent to each contact as soon as it is online
+    futures = dendrotox.queue_message(
+        contacts    = contacts,
+        text        = text,
+        priority    = True,
+        when_online = True,
+        ttl         = ttl
+    )
+    results = dict((contact, future.result()) for contact, future in futures.items())
+    dendrotox.log.info("alert sent to {sent} of {total} contacts".format(
+        sent  = sum(results.values()),
+        total = len(results)
+    ))
     #dendrotox.stop_messaging()
 
 if __name__ == "__main__":
@@ -43,11 +43,12 @@ options:
 
     --contacts=ID  comma-delimited approved contacts  [default: all]
     --text=TEXT    text to send                       [default: This is a test of the emergency broadcasting system.]
+    --workers=INT  maximum number of concurrent calls [default: 8]
+    --warm         synthesize text to speech cache and exit
 """
 
 import docopt
 import socket
-import time
 
 import dendrotox
 
@@ -58,19 +59,49 @@ def main(options):
 
     contacts = options["--contacts"]
     text     = options["--text"]
-    dendrotox.start_messaging(pause_time = 60)
-    dendrotox.set_name(text = name + "@" + socket.gethostname())
-    if contacts != "all": contacts = options["--contacts"].split(",")
-    if contacts == "all": contacts = dendrotox.all_contacts()
-    for contact in contacts:
-        dendrotox.send_call_synthesized_speech(
-            contact            = contact,
-            text               = text,
+    if options["--warm"]:
+        dendrotox.warm_speech_cache(
+            texts              = [text],
             preference_program = "festival"
-            #preference_program = "pico2wave"
-            #preference_program = "espeak"
-            #preference_program = "deep_throat.py"
         )
+        return
+    if contacts != "all": contacts = options["--contacts"].split(",")
+    dendrotox.start_messaging(
+        pause_time = 60,
+        contacts   = contacts,
+        features   = ["text", "calls", "speech"]
+    )
+    dendrotox.set_name(text = name + "@" + socket.gethostname())
+    if contacts == "all": contacts = dendrotox.all_contacts()
+    results = dendrotox.send_calls_synthesized_speech(
+        contacts           = contacts,
+        text               = text,
+        preference_program = "festival",
+        #preference_program = "pico2wave",
+        #preference_program = "espeak",
+        #preference_program = "deep_throat.py",
+        workers            = int(options["--workers"])
+    )
+    # a call is False if it could not be placed
+    answered = [
+        contact for contact, call in results.items()\
+        if call is not False and call.answered()
+    ]
+    for contact, call in sorted(results.items()):
+        if contact in answered:
+            status = "answered after {time:.1f} s".format(time = call.time_to_answer())
+        elif call:
+            status = "streamed but not confirmed answered"
+        else:
+            status = "not answered"
+        dendrotox.log.info("{contact}: {status}".format(
+            contact = contact,
+            status  = status
+        ))
+    dendrotox.log.info("calls answered: {answered} of {total}".format(
+        answered = len(answered),
+        total    = len(results)
+    ))
     #dendrotox.stop_messaging()
 
 if __name__ == "__main__":
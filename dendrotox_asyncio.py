@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+################################################################################
+#                                                                              #
+# dendrotox_asyncio                                                            #
+#                                                                              #
+################################################################################
+#                                                                              #
+# LICENCE INFORMATION                                                          #
+#                                                                              #
+# This program is an asyncio interface to Tox distributed communications.      #
+#                                                                              #
+# copyright (C) 2018 William Breaden Madden                                    #
+#                                                                              #
+# This software is released under the terms of the GNU General Public License  #
+# version 3 (GPLv3).                                                           #
+#                                                                              #
+# This program is free software: you can redistribute it and/or modify it      #
+# under the terms of the GNU General Public License as published by the Free   #
+# Software Foundation, either version 3 of the License, or (at your option)    #
+# any later version.                                                           #
+#                                                                              #
+# This program is distributed in the hope that it will be useful, but WITHOUT  #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or        #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for     #
+# more details.                                                                #
+#                                                                              #
+# For a copy of the GNU General Public License, see                            #
+# <http://www.gnu.org/licenses/>.                                              #
+#                                                                              #
+################################################################################
+"""
+
+import asyncio
+import functools
+import time
+
+import dendrotox
+
+name    = "dendrotox_asyncio"
+version = "2018-03-03T0125Z"
+
+log = dendrotox.log
+
+class Client(object):
+
+    def __init__(
+        self,
+        loop = None
+        ):
+        """
+        asyncio client of the ratox FIFO tree at the working directory. Changes
+        detected by the dendrotox watcher wake waiting coroutines, so one event
+        loop can hold many conversations without a thread or a polling loop
+        per conversation. Blocking writes are run in the default executor.
+        """
+        self._loop            = loop or asyncio.get_event_loop()
+        self._generation      = 0
+        self._generation_read = None
+        self._waiters         = set()
+        self._watcher         = dendrotox.get_watcher()
+        self._watcher.add_callback(self._on_change)
+
+    def close(
+        self
+        ):
+        self._watcher.remove_callback(self._on_change)
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.cancel()
+        self._waiters.clear()
+
+    def _on_change(
+        self,
+        paths = None
+        ):
+        # called from the watcher thread
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # event loop closed
+            pass
+
+    def _wake(
+        self
+        ):
+        self._generation += 1
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(self._generation)
+        self._waiters.clear()
+
+    async def wait_for_event(
+        self,
+        generation = None,
+        timeout    = None  # s
+        ):
+        """
+        Wait until a change is detected after the specified generation (by
+        default, the current generation) or until the timeout and return the
+        generation reached.
+        """
+        if generation is None:
+            generation = self._generation
+        if self._generation != generation:
+            return self._generation
+        waiter = self._loop.create_future()
+        self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters.discard(waiter)
+        return self._generation
+
+    async def _refresh(
+        self,
+        force = False # read even without a change, such as after a missed one
+        ):
+        # read new messages at most once per change, off the event loop thread,
+        # as reading text_out and saving read state block
+        if force or self._generation_read != self._generation:
+            self._generation_read = self._generation
+            await self._loop.run_in_executor(None, dendrotox.get_messages)
+
+    async def _unseen(
+        self,
+        contact  = None,  # Tox ID or public key
+        contacts = None,  # list of Tox IDs or public keys
+        force    = False
+        ):
+        await self._refresh(force = force)
+        if contact:
+            contacts = [contact]
+        if contacts == "all":
+            contacts = None
+        if contacts:
+            contacts = [contact[:64] for contact in contacts]
+        return dendrotox.message_store.messages(
+            contacts = contacts or None,
+            unseen   = True
+        )
+
+    async def messages(
+        self,
+        contact  = None, # Tox ID or public key
+        contacts = None, # list of Tox IDs or public keys
+        consumer = None, # name of consumer
+        poll     = 1     # s, guard against missed notifications
+        ):
+        """
+        Yield unseen messages from the specified contact or contacts (by
+        default, all contacts) as they are received, setting each seen. If a
+        consumer is specified, messages not yet read by that consumer are
+        yielded instead, independently of seen flags.
+        """
+        timed_out = False
+        while True:
+            generation = self._generation
+            if consumer is None:
+                messages = await self._unseen(
+                    contact  = contact,
+                    contacts = contacts,
+                    force    = timed_out
+                )
+            else:
+                await self._refresh(force = timed_out)
+                messages = dendrotox.consume_messages(
+                    name     = consumer,
+                    contact  = contact,
+                    contacts = contacts
+                )
+            for message in messages:
+                if consumer is not None:
+                    yield message
+                elif not message.seen():
+                    message.set_seen()
+                    yield message
+            timed_out = False
+            if not messages:
+                timed_out = await self.wait_for_event(
+                    generation = generation,
+                    timeout    = poll
+                ) == generation
+
+    async def wait_for_message(
+        self,
+        contact  = None, # Tox ID or public key
+        contacts = None, # list of Tox IDs or public keys
+        timeout  = None, # s
+        poll     = 1     # s, guard against missed notifications
+        ):
+        """
+        Wait for an unseen message from the specified contact or contacts and
+        return it, or return None if no message is received before the timeout.
+        """
+        if timeout is not None:
+            time_stop = time.time() + timeout
+        timed_out = False
+        while True:
+            generation = self._generation
+            messages = await self._unseen(
+                contact  = contact,
+                contacts = contacts,
+                force    = timed_out
+            )
+            if messages:
+                return messages[-1]
+            time_wait = poll
+            if timeout is not None:
+                time_wait = min(poll, time_stop - time.time())
+                if time_wait <= 0:
+                    return None
+            timed_out = await self.wait_for_event(
+                generation = generation,
+                timeout    = time_wait
+            ) == generation
+
+    async def send_message(
+        self,
+        contact  = None, # Tox ID or public key
+        contacts = None, # list of Tox IDs or public keys
+        text     = None, # text to send
+        filepath = None  # file to send
+        ):
+        return await self._loop.run_in_executor(
+            None,
+            functools.partial(
+                dendrotox.send_message,
+                contact  = contact,
+                contacts = contacts,
+                text     = text,
+                filepath = filepath
+            )
+        )
+
+    async def get_input(
+        self,
+        contact = None,     # Tox ID or public key
+        prompt  = "input: ",
+        timeout = None      # s
+        ):
+        """
+        Send a prompt to a contact and return the text of their response, or
+        return None if there is no response before the timeout.
+        """
+        await self.send_message(contact = contact, text = prompt)
+        message = await self.wait_for_message(contact = contact, timeout = timeout)
+        if message is None:
+            return None
+        return message.text()
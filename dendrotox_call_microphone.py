@@ -47,7 +47,6 @@ options:
 
 import docopt
 import socket
-import time
 
 import dendrotox
 
@@ -58,16 +57,25 @@ def main(options):
 
     contacts        =     options["--contacts"]
     duration_record = int(options["--duration_record"])
-    dendrotox.start_messaging(pause_time = 60)
-    dendrotox.set_name(text = name + "@" + socket.gethostname())
     if contacts != "all": contacts = options["--contacts"].split(",")
+    dendrotox.start_messaging(
+        pause_time = 60,
+        contacts   = contacts,
+        features   = ["text", "calls", "microphone"]
+    )
+    dendrotox.set_name(text = name + "@" + socket.gethostname())
     if contacts == "all": contacts = dendrotox.all_contacts()
-    for contact in contacts:
-        dendrotox.send_call(
-            contact         = contact,
-            record          = True,
-            duration_record = duration_record
-        )
+    results = dendrotox.send_calls_microphone(
+        contacts        = contacts,
+        duration_record = duration_record
+    )
+    # a call is False if it could not be placed
+    dendrotox.log.info("calls answered: {answered} of {total}".format(
+        answered = sum(
+            1 for call in results.values() if call is not False and call.answered()
+        ),
+        total    = len(results)
+    ))
     #dendrotox.stop_messaging()
 
 if __name__ == "__main__":
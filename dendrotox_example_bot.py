@@ -48,7 +48,6 @@ options:
 import docopt
 import os
 import sys
-import time
 import uuid
 
 import dendrotox
@@ -101,8 +100,12 @@ def main(options):
             text     = message
         )
 
+    watcher = dendrotox.get_watcher()
+
     while True:
 
+        generation = watcher.generation()
+
         message = dendrotox.last_received_message(contact = approved_contact)
 
         try:
@@ -183,7 +186,9 @@ def main(options):
                 text    = "error"
             )
 
-        time.sleep(0.3)
+        if not message:
+
+            watcher.wait(generation = generation, timeout = 1)
 
 def parse_networking(
     text = None
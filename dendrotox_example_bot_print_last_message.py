@@ -42,7 +42,6 @@ options:
 """
 
 import docopt
-import time
 
 import dendrotox
 
@@ -55,8 +54,12 @@ def main(options):
 
     print("main program loop -- display all messages received")
 
+    watcher = dendrotox.get_watcher()
+
     while True:
 
+        generation = watcher.generation()
+
         message = dendrotox.last_received_message()
 
         if message:
@@ -70,7 +73,8 @@ def main(options):
                 text      = message.text()
             ))
 
-        time.sleep(0.3)
+        else:
+            watcher.wait(generation = generation, timeout = 1)
 
 if __name__ == "__main__":
     options = docopt.docopt(__doc__)
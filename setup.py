@@ -17,12 +17,14 @@ def main():
         author_email     = "wbm@protonmail.ch",
         license          = "GPLv3",
         py_modules       = [
-                           "dendrotox"
+                           "dendrotox",
+                           "dendrotox_asyncio"
                            ],
         install_requires = [
                            "docopt",
+                           "futures;python_version<'3.0'",
                            "megaparsex",
-                           "pydub",
+                           "numpy",
                            "subprocess32;python_version<'3.0'"
                            ],
         scripts          = [